@@ -0,0 +1,80 @@
+"""
+Recall vs latency of the IVF matcher index against exact search
+
+Builds a synthetic gallery of clustered 512-d embeddings (a few samples per
+identity, like tagged faces over several years) and times both backends.
+
+usage: python -m benchmarks.matcher_benchmark --profiles 200000 --queries 500
+"""
+import time
+import argparse
+import numpy as np
+
+from miles_api.matcher import Embeddings, ExactIndex, IVFIndex, normalize_rows
+from miles_api.embedding_store import quantize
+
+
+def synthetic_gallery(n_profiles, n_queries, dim, samples_per_identity, noise, seed=0):
+    rng = np.random.default_rng(seed)
+
+    identities = normalize_rows(rng.standard_normal((n_profiles // samples_per_identity + 1, dim)).astype(np.float32))
+    owners = np.arange(n_profiles) // samples_per_identity
+    gallery = normalize_rows(identities[owners] + noise * rng.standard_normal((n_profiles, dim)).astype(np.float32))
+
+    # Queries are fresh noisy samples of identities already in the gallery
+    query_owners = rng.integers(0, owners[-1] + 1, n_queries)
+    queries = normalize_rows(identities[query_owners] + noise * rng.standard_normal((n_queries, dim)).astype(np.float32))
+
+    return np.ascontiguousarray(gallery), np.ascontiguousarray(queries)
+
+
+def timed_search(index, queries, k, batch=None):
+    batch = batch or len(queries)
+    start = time.perf_counter()
+    results = [result for offset in range(0, len(queries), batch) for result in index.search(queries[offset:offset + batch], k)]
+    elapsed = time.perf_counter() - start
+    return [set(matches.tolist()) for matches, _ in results], 1000 * elapsed / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profiles', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--samples-per-identity', type=int, default=20)
+    parser.add_argument('--noise', type=float, default=0.05)
+    parser.add_argument('--lists', type=int, default=0)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--batch', type=int, default=0, help='Faces per search call, like the few faces of one upload (0: all queries at once)')
+    parser.add_argument('--dtype', choices=['float32', 'float16', 'int8'], default='float32')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    gallery, queries = synthetic_gallery(args.profiles, args.queries, args.dim, args.samples_per_identity, args.noise)
+
+    # Ground truth is always float32 exact search
+    exact_top1 = ExactIndex(Embeddings(gallery)).search(queries, 1)
+    exact, _ = timed_search(ExactIndex(Embeddings(gallery)), queries, args.k)
+
+    embeddings = Embeddings(*quantize(gallery, args.dtype))
+    _, exact_ms = timed_search(ExactIndex(embeddings), queries, args.k, args.batch)
+    print(f"exact: {exact_ms:.3f} ms/face over {len(gallery)} {args.dtype} profiles")
+
+    start = time.perf_counter()
+    ivf = IVFIndex.build(embeddings, fingerprint='benchmark', n_lists=args.lists)
+    print(f"ivf: built {len(ivf.centroids)} lists in {time.perf_counter() - start:.1f}s")
+
+    print(f"{'nprobe':>8} {'recall@1':>9} {'recall@' + str(args.k):>9} {'ms/face':>9} {'speedup':>8}")
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        approx, approx_ms = timed_search(ivf, queries, args.k, args.batch)
+
+        approx_top1 = ivf.search(queries, 1)
+        recall_1 = np.mean([a[0][:1].tolist() == e[0][:1].tolist() for a, e in zip(approx_top1, exact_top1)])
+        recall_k = np.mean([len(a & e) / len(e) for a, e in zip(approx, exact)])
+
+        print(f"{nprobe:>8} {recall_1:>9.3f} {recall_k:>9.3f} {approx_ms:>9.3f} {exact_ms / approx_ms:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+CPU time and extractor bytes per request: legacy predict path vs prepare_image
+
+The legacy path is the old predict_label_images body: decode, convert,
+re-encode to JPEG, base64 + JSON, then draw and encode the response.
+Faces are faked, so no extractor is needed.
+
+usage: python -m benchmarks.predict_pipeline_benchmark photo.jpg [photo2.png ...] --runs 20
+"""
+import json
+import time
+import argparse
+
+from io import BytesIO
+from base64 import b64encode
+from PIL import Image, ImageDraw
+
+from miles_api.images import prepare_image, annotate
+
+FAKE_FACES = [{'bbox': [100 + 150 * i, 100, 220 + 150 * i, 250]} for i in range(5)]
+FAKE_LABELS = [f'Person{i}' for i in range(len(FAKE_FACES))]
+
+
+def legacy_pipeline(data):
+    overlay_image = Image.open(BytesIO(data)).convert('RGB')
+    draw = ImageDraw.Draw(overlay_image)
+
+    img_jpg = BytesIO()
+    overlay_image.save(img_jpg, format="JPEG")
+    payload = json.dumps({"images": {"data": [b64encode(img_jpg.getvalue()).decode('utf-8')]}})
+
+    for face, label in zip(FAKE_FACES, FAKE_LABELS):
+        left, top, right, bottom = face['bbox']
+        draw.rectangle(((left, top), (right, bottom)), outline=(0, 0, 255))
+        draw.text((left + 6, bottom - 15), label, fill=(255, 255, 255, 255))
+    del draw
+
+    output_image_stream = BytesIO()
+    overlay_image.save(output_image_stream, format='JPEG')
+    return len(payload)
+
+
+def lean_pipeline(data, multipart):
+    prepared = prepare_image(data)
+    annotate(prepared.decode(), FAKE_FACES, FAKE_LABELS)
+
+    if multipart:
+        return len(prepared.payload)
+    return len(json.dumps({"images": {"data": [b64encode(prepared.payload).decode('utf-8')]}}))
+
+
+def measure(pipeline, data, runs):
+    start = time.process_time()
+    for _ in range(runs):
+        sent = pipeline(data)
+    return 1000 * (time.process_time() - start) / runs, sent
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'image':<30} {'path':<16} {'cpu ms':>8} {'bytes sent':>11}")
+    for path in args.images:
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        for name, pipeline in [
+            ('legacy', legacy_pipeline),
+            ('lean (json)', lambda d: lean_pipeline(d, multipart=False)),
+            ('lean (multipart)', lambda d: lean_pipeline(d, multipart=True)),
+        ]:
+            cpu_ms, sent = measure(pipeline, data, args.runs)
+            print(f"{path[-30:]:<30} {name:<16} {cpu_ms:>8.1f} {sent:>11}")
+
+
+if __name__ == '__main__':
+    main()
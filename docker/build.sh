@@ -10,6 +10,8 @@ set -e
 
 docker build .. -f Dockerfile-api -t animcogn/miles:api-0.2
 
+docker build .. -f Dockerfile-worker -t animcogn/miles:worker-0.2
+
 docker build .. -f Dockerfile-slack -t animcogn/miles:slack-0.2
 
 #docker image push animcogn/miles:index-0.2
@@ -20,4 +22,6 @@ docker build .. -f Dockerfile-slack -t animcogn/miles:slack-0.2
 
 docker image push animcogn/miles:api-0.2
 
+docker image push animcogn/miles:worker-0.2
+
 docker image push animcogn/miles:slack-0.2
@@ -0,0 +1,84 @@
+import json
+import time
+import hashlib
+
+from collections import OrderedDict
+from loguru import logger
+
+from miles_api.resources.default_configs import (
+    PREDICT_CACHE_BACKEND,
+    PREDICT_CACHE_SIZE,
+    PREDICT_CACHE_TTL
+)
+
+
+def image_hash(data: bytes):
+    """
+    MD5 of the raw bytes, same as the Drive hashes in images_index
+    """
+    return hashlib.md5(data).hexdigest()
+
+
+class FaceCache:
+    """
+    Extractor results (face boxes + embeddings, and the size of the image
+    they were found in) keyed by image content hash
+
+    Entries are also keyed by a generation (the gallery fingerprint), so
+    they stop being served as soon as known_encodings changes. Lives in
+    process as a bounded LRU, or in Redis with a TTL so workers share it.
+    """
+
+    def __init__(self, r=None, backend=PREDICT_CACHE_BACKEND, max_items=PREDICT_CACHE_SIZE, ttl=PREDICT_CACHE_TTL, prefix='predict_cache_v2'):
+        self.r = r
+        self.backend = backend
+        self.max_items = max_items
+        self.ttl = ttl
+        self.prefix = prefix
+        self.entries = OrderedDict()
+        self.hits = self.misses = 0
+
+    def _key(self, generation, img_hash):
+        return f"{self.prefix}:{generation}:{img_hash}"
+
+    def get(self, generation, img_hash):
+        """
+        return: {'faces': [...], 'size': [width, height]} or None
+        """
+        key = self._key(generation, img_hash)
+
+        if self.backend == 'redis':
+            cached = self.r.get(key)
+            entry = json.loads(cached) if cached is not None else None
+        else:
+            expires, entry = self.entries.pop(key, (0, None))
+            if expires > time.monotonic():
+                self.entries[key] = (expires, entry)  # Most recently used goes last
+            else:
+                entry = None
+
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            logger.debug(f"Cache hit: {img_hash} ({self.hits} hits / {self.misses} misses)")
+
+        return entry
+
+    def set(self, generation, img_hash, faces, size):
+        key = self._key(generation, img_hash)
+        entry = {'faces': faces, 'size': list(size)}
+
+        if self.backend == 'redis':
+            self.r.set(key, json.dumps(entry), ex=self.ttl)
+            return
+
+        self.entries[key] = (time.monotonic() + self.ttl, entry)
+        while len(self.entries) > self.max_items:
+            self.entries.popitem(last=False)
+
+    def invalidate(self):
+        """
+        Drop every in-process entry (Redis entries expire or are orphaned by a new generation)
+        """
+        self.entries.clear()
@@ -0,0 +1,191 @@
+import time
+import pickle
+import numpy as np
+
+from loguru import logger
+from collections import defaultdict
+
+from miles_api.matcher import normalize_rows
+from miles_api.face_table import FaceTable
+from miles_api.face_maps import add_face_images, clear_face_images
+
+UNKNOWN = -1
+
+
+def import_legacy_face_encodings(r, legacy_key: str, table: FaceTable, batch_size: int = 1000):
+    """
+    Copy faces stored the old way (pickled {img_hash, encoding, box} set members) into a face table
+
+    Used for the cluster init faces, which were only ever extracted into such sets
+
+    return: faces imported
+    """
+    imported = 0
+    batch = []
+
+    def flush():
+        pipe = r.pipeline()
+        table.append(
+            pipe,
+            table.reserve(len(batch)),
+            vecs=[face['encoding'] for face in batch],
+            boxes=[face['box'] for face in batch],
+            img_hashes=[face['img_hash'] for face in batch]
+        )
+        pipe.execute()
+        batch.clear()
+
+    for member in r.sscan_iter(legacy_key, count=batch_size):
+        batch.append(pickle.loads(member))
+        imported += 1
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+
+    logger.info(f"Imported {imported} faces from {legacy_key} into {table.key}")
+    return imported
+
+
+def seed_centroids(init_table: FaceTable, label_profile_map: dict):
+    """
+    One normalized centroid per person from the labelled cluster init faces (Lifetouch portraits)
+
+    label_profile_map: {image hash: profile name}
+    return: names, centroids (people x dim, float32)
+    """
+    sums = {}
+    for _, vecs, _, img_hashes in init_table.iter_segments():
+        for vec, img_hash in zip(normalize_rows(vecs), img_hashes.astype(str)):
+            name = label_profile_map.get(img_hash)
+            if name is None:
+                continue
+            sums[name] = sums[name] + vec if name in sums else vec.copy()
+
+    names = sorted(sums)
+    centroids = normalize_rows(np.asarray([sums[name] for name in names], dtype=np.float32).reshape(len(names), -1))
+    logger.debug(f"Seeded {len(names)} centroids from {init_table.key}")
+    return names, np.ascontiguousarray(centroids, dtype=np.float32)
+
+
+def assign(centroids, vecs, min_similarity: float):
+    """
+    Nearest centroid for every face, UNKNOWN below min_similarity (cosine)
+
+    return: labels, similarities
+    """
+    sims = normalize_rows(np.asarray(vecs, dtype=np.float32)) @ centroids.T
+    labels = sims.argmax(axis=1).astype(np.int32)
+    best = sims[np.arange(len(labels)), labels]
+    labels[best < min_similarity] = UNKNOWN
+    return labels, best
+
+
+def refine_centroids(table: FaceTable, centroids, min_similarity: float, iterations: int = 1):
+    """
+    Seeded mini-batch k-means: every table segment is one mini-batch
+
+    Each centroid moves towards the faces assigned to it with a per-centroid
+    learning rate of 1 / faces seen so far (as in sklearn's MiniBatchKMeans).
+    Faces below min_similarity stay out of the update, so strangers don't
+    drag a person's centroid away from their portrait
+
+    return: refined centroids (normalized)
+    """
+    centroids = centroids.copy()
+    counts = np.ones(len(centroids), dtype=np.float64)  # The seed counts as one face
+
+    for iteration in range(iterations):
+        start = time.monotonic()
+        for _, vecs, _, _ in table.iter_segments():
+            faces = normalize_rows(np.asarray(vecs, dtype=np.float32))
+            labels, _ = assign(centroids, faces, min_similarity)
+
+            known = labels != UNKNOWN
+            for label in np.unique(labels[known]):
+                members = faces[labels == label]
+                counts[label] += len(members)
+                centroids[label] += (members.sum(axis=0) - len(members) * centroids[label]) / counts[label]
+
+            centroids = normalize_rows(centroids)
+
+        logger.debug(f"Mini-batch k-means pass {iteration + 1}/{iterations} done in {time.monotonic() - start:.1f}s")
+
+    return np.ascontiguousarray(centroids, dtype=np.float32)
+
+
+def label_faces(table: FaceTable, names, centroids, min_similarity: float, redis_faces_to_images: str, on_progress=None):
+    """
+    Assign every face in the table a person (or UNKNOWN), one segment at a time
+
+    Labels are written next to each segment and every labelled image is
+    added to its person's set as soon as its segment is done
+
+    return: labelled / unknown face counts
+    """
+    # Labels index the table's shared name list, which is only ever appended to (see FaceTable.add_label_names)
+    positions = table.add_label_names(names)
+    label_index = np.asarray([positions[name] for name in names], dtype=np.int32)
+
+    stats = defaultdict(int)
+    processed = 0
+
+    for ids, vecs, _, img_hashes in table.iter_segments():
+        labels, _ = assign(centroids, vecs, min_similarity)
+
+        pipe = table.r.pipeline(transaction=False)
+        table.set_labels(pipe, int(ids[0]), np.where(labels != UNKNOWN, label_index[labels], UNKNOWN))
+        pipe.execute()
+
+        known = labels != UNKNOWN
+        add_face_images(table.r, redis_faces_to_images, ((names[label], img_hash) for label, img_hash in zip(labels[known], img_hashes[known].astype(str))))
+
+        stats['unknown'] += int((~known).sum())
+        stats['labelled'] += int(known.sum())
+        processed += len(ids)
+        if on_progress:
+            on_progress(processed)
+
+    return dict(stats)
+
+
+def cluster_faces(
+        r,
+        table: FaceTable,
+        init_table: FaceTable,
+        label_profile_map: dict,
+        redis_faces_to_images: str,
+        redis_centroids: str,
+        method: str = 'kmeans',
+        iterations: int = 1,
+        min_similarity: float = 0.4,
+        rebuild: bool = True,
+        on_progress=None
+):
+    """
+    Cluster every extracted face around the seeded people, streaming the face table
+
+    method: 'nearest' (one pass against the seeds) or 'kmeans' (seeded
+    mini-batch k-means for iterations passes, then one labelling pass)
+
+    Memory stays bounded by one fetch of segments plus the centroids,
+    whatever the number of faces
+    """
+    names, centroids = seed_centroids(init_table, label_profile_map)
+    if not names:
+        raise ValueError(f"No labelled faces in {init_table.key} to seed clusters with")
+
+    if method == 'kmeans':
+        centroids = refine_centroids(table, centroids, min_similarity, iterations)
+
+    if rebuild:
+        clear_face_images(r, redis_faces_to_images)
+
+    stats = label_faces(table, names, centroids, min_similarity, redis_faces_to_images, on_progress)
+
+    # Same format as known_encodings; only promoted to the gallery on request (see tasks.cluster_faces_process)
+    r.set(redis_centroids, pickle.dumps({name: centroid.tolist() for name, centroid in zip(names, centroids)}))
+
+    logger.info(f"Clustered faces into {len(names)} people: {stats}")
+    return stats
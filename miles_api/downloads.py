@@ -0,0 +1,248 @@
+import os
+import time
+import queue
+import magic
+import shutil
+import tempfile
+import threading
+
+from collections import Counter
+
+from loguru import logger
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from miles_api.rclone import copy_files_from
+
+# One libmagic handle per process pool worker
+_mime = None
+
+_STOP = object()
+
+
+def transfer(source: str, local_download_folder: str, batch: dict, transfers: int, checkers: int):
+    """
+    Stage 1 (I/O, thread pool): copy a batch of files from the drive with one rclone process
+
+    Files land in a staging folder under their drive paths, then are
+    renamed to {local_download_folder}/{image hash}. A path shared by
+    several hashes (stale index entries) is copied once per extra hash,
+    and every hash succeeds or fails on its own
+
+    batch: {image hash: path on the drive}
+    return: {image hash: error message or None}
+    """
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=local_download_folder)
+    try:
+        copied = copy_files_from(source, staging, list(dict.fromkeys(batch.values())), transfers=transfers, checkers=checkers)
+
+        remaining = Counter(batch.values())  # Hashes still to be served by each staged file
+        results = {}
+        for image_hash, image_name in batch.items():
+            remaining[image_name] -= 1
+            results[image_hash] = copied[image_name]
+            if results[image_hash] is not None:
+                continue
+
+            staged_path = os.path.join(staging, image_name)
+            try:
+                if remaining[image_name]:
+                    shutil.copyfile(staged_path, f'{local_download_folder}/{image_hash}')
+                else:
+                    os.replace(staged_path, f'{local_download_folder}/{image_hash}')
+            except OSError as e:
+                results[image_hash] = f'{type(e).__name__}: {e}'
+        return results
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def check_and_resize(downloaded_path: str, output_path: str, max_image_size):
+    """
+    Stage 2 (CPU, process pool): make sure we got a JPEG and shrink it
+
+    return: None if ok, otherwise the reason the image was skipped
+    """
+    global _mime
+    if _mime is None:
+        _mime = magic.Magic(mime=True)
+
+    # Double check file type
+    mime_type = _mime.from_file(downloaded_path)
+    if mime_type != "image/jpeg":
+        os.remove(downloaded_path)
+        return mime_type
+
+    # Resize our image to fit max_image_size
+    try:
+        img = Image.open(downloaded_path)
+        img.draft('RGB', tuple(max_image_size))  # Let libjpeg decode at reduced scale
+        img.load()
+        os.remove(downloaded_path)
+        img.thumbnail(size=max_image_size)
+        img.save(output_path, "JPEG")
+    except OSError:
+        return 'OSError'
+
+    return None
+
+
+class RedisWriter(threading.Thread):
+    """
+    Stage 3: batches results into pipelined writes to the downloaded / skipped keys
+    """
+
+    def __init__(self, r, redis_downloaded_images, redis_skipped_images, batch_size=100, flush_interval=1.):
+        super().__init__(daemon=True)
+        self.r = r
+        self.redis_downloaded_images = redis_downloaded_images
+        self.redis_skipped_images = redis_skipped_images
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.results = queue.Queue()
+
+    def put(self, image_hash, skipped_reason=None):
+        self.results.put((image_hash, skipped_reason))
+
+    def close(self):
+        self.results.put(_STOP)
+        self.join()
+
+    def run(self):
+        pipe = self.r.pipeline(transaction=False)
+        last_flush = time.monotonic()
+
+        while True:
+            try:
+                result = self.results.get(timeout=self.flush_interval)
+            except queue.Empty:
+                result = None
+
+            if result is _STOP:
+                pipe.execute()
+                return
+
+            if result is not None:
+                image_hash, skipped_reason = result
+                if skipped_reason is None:
+                    pipe.sadd(self.redis_downloaded_images, image_hash)
+                else:
+                    pipe.hset(self.redis_skipped_images, image_hash, skipped_reason)
+
+            if len(pipe) >= self.batch_size or (len(pipe) and time.monotonic() - last_flush >= self.flush_interval):
+                pipe.execute()
+                last_flush = time.monotonic()
+
+
+def download_images(
+        r,
+        images: dict,
+        rclone_drive: str,
+        path: str,
+        local_download_folder: str,
+        max_image_size,
+        redis_downloaded_images: str,
+        redis_skipped_images: str,
+        download_concurrency: int = 2,
+        transfer_batch_size: int = 200,
+        rclone_transfers: int = 8,
+        rclone_checkers: int = 16,
+        process_concurrency: int = None,
+        redis_batch_size: int = 100,
+        on_progress=None
+):
+    """
+    Download, check and resize images as a pipeline of independently sized stages
+
+    Each transfer copies transfer_batch_size files in one rclone process
+    (rclone_transfers at a time), instead of paying rclone startup, config
+    parsing and token refresh for every small JPEG
+
+    images: {image hash: path on the drive}
+    process_concurrency: check / resize processes, this machine's CPU count when None
+    on_progress: called with the number of images finished so far
+    """
+    process_concurrency = process_concurrency or os.cpu_count() or 4
+    total = len(images)
+    start = time.monotonic()
+    done = 0
+    done_lock = threading.Lock()
+
+    # Bounds images in flight across both stages so we never queue the whole drive at once
+    in_flight = download_concurrency * transfer_batch_size + 2 * process_concurrency
+    slots = threading.Semaphore(in_flight)
+
+    writer = RedisWriter(r, redis_downloaded_images, redis_skipped_images, batch_size=redis_batch_size)
+    writer.start()
+
+    def finish(image_hash, skipped_reason=None, record=True):
+        nonlocal done
+        if record:
+            writer.put(image_hash, skipped_reason)
+        slots.release()
+
+        with done_lock:
+            done += 1
+            if done % 100 == 0 or done == total:
+                elapsed = time.monotonic() - start
+                logger.info(f"{done}/{total} images downloaded... ({done / max(elapsed, 1e-6):.1f} images/sec)")
+                if on_progress:
+                    on_progress(done)
+
+    with ThreadPoolExecutor(download_concurrency) as transfers, ProcessPoolExecutor(process_concurrency) as processors:
+
+        def on_processed(image_hash, future):
+            try:
+                skipped_reason = future.result()
+            except Exception as e:
+                skipped_reason = f'{type(e).__name__}: {e}'
+
+            if skipped_reason is not None:
+                logger.error(f'Skipped image: {image_hash} ({skipped_reason})')
+            finish(image_hash, skipped_reason)
+
+        def on_transferred(batch, future):
+            try:
+                results = future.result()
+            except Exception as e:
+                # The batch as a whole failed (not the files): leave it unrecorded so the next run retries it
+                logger.error(f'Unable to transfer {len(batch)} images: {type(e).__name__}: {e}')
+                for image_hash in batch:
+                    finish(image_hash, record=False)
+                return
+
+            for image_hash, error in results.items():
+                if error is not None:
+                    logger.error(f'Skipped image: {batch[image_hash]}! Unable to download: {error}')
+                    finish(image_hash, "unable to download")
+                    continue
+
+                downloaded_path = f'{local_download_folder}/{image_hash}'
+                try:
+                    processing = processors.submit(check_and_resize, downloaded_path, f'{downloaded_path}.jpg', max_image_size)
+                except Exception as e:
+                    finish(image_hash, f'{type(e).__name__}: {e}')
+                    continue
+                processing.add_done_callback(lambda f, h=image_hash: on_processed(h, f))
+
+        def submit(batch):
+            transferring = transfers.submit(transfer, f'{rclone_drive}:/{path}', local_download_folder, batch, rclone_transfers, rclone_checkers)
+            transferring.add_done_callback(lambda f: on_transferred(batch, f))
+
+        batch = {}
+        for image_hash, image_name in images.items():
+            slots.acquire()
+            batch[image_hash] = image_name
+            if len(batch) >= transfer_batch_size:
+                submit(batch)
+                batch = {}
+
+        if batch:
+            submit(batch)
+
+        # Wait for everything in flight to drain before shutting the pools down
+        for _ in range(in_flight):
+            slots.acquire()
+
+    writer.close()
+    logger.info(f"Done! {total} images in {time.monotonic() - start:.1f}s")
@@ -0,0 +1,210 @@
+import json
+import time
+
+from loguru import logger
+
+
+def _decode_meta(meta):
+    return json.loads(meta) if meta is not None else None
+
+
+def sync_images_index(
+        r,
+        drive_files,
+        redis_images_index: str,
+        redis_images_meta: str,
+        redis_images_changes: str,
+        chunk_size: int = 5000,
+        changes_max_len: int = 1000000,
+        on_progress=None
+):
+    """
+    Diffs a fresh Drive listing against the metadata stored last time
+
+    Only adds, moves, modifications and deletes are written to the image
+    index (md5 -> path), and each one is appended to a Redis stream (the
+    change feed) that downstream stages can consume with XREAD
+
+    Adds and modifications are written chunk_size images at a time while
+    rclone is still listing, so memory stays flat whatever the drive size.
+    Only what needs the full listing waits for the end: telling moves
+    from copies, and finding deleted paths
+
+    A path's metadata is only written in the same MULTI / EXEC as its
+    index change and its event, so a crashed run loses nothing: whatever
+    wasn't committed is still different from the stored metadata next time.
+    md5s that may have lost their last path are kept in {meta}:dropped
+    until they're resolved, surviving a crash too
+
+    drive_files: rclone lsjson entries (with --hash)
+    on_progress: called with (images listed, change counts)
+    return: change counts
+    """
+    seen_key = f"{redis_images_meta}:seen"  # Paths in this listing
+    dropped_key = f"{redis_images_meta}:dropped"  # md5s whose index entry may point to a path that no longer has them
+
+    start = time.monotonic()
+    first_run = r.hlen(redis_images_meta) == 0
+    stats = {'seen': 0, 'add': 0, 'move': 0, 'modify': 0, 'delete': 0}
+    deferred = []  # (path, meta, old path): new paths whose content is indexed at a known path, a move or a copy
+    chunk = []
+
+    r.delete(seen_key)
+
+    pipe = r.pipeline()
+
+    def emit(op, md5, path, old_path='', old_md5=''):
+        stats[op] += 1
+        pipe.xadd(redis_images_changes, {'op': op, 'md5': md5, 'path': path, 'old_path': old_path, 'old_md5': old_md5}, maxlen=changes_max_len, approximate=True)
+
+    def flush():
+        # Only called between paths, so a path's writes always commit together
+        pipe.execute()
+        if on_progress:
+            on_progress(stats['seen'], stats)
+
+    def write_chunk():
+        paths = [path for path, _ in chunk]
+
+        lookup = r.pipeline(transaction=False)
+        lookup.hmget(redis_images_meta, paths)
+        lookup.hmget(redis_images_index, [meta['md5'] for _, meta in chunk])
+        previous, indexed = lookup.execute()
+
+        # Where the new paths' content is indexed, if that path is one we listed before
+        candidates = {path: indexed_path.decode('utf-8') for (path, meta), old, indexed_path in zip(chunk, previous, indexed)
+                      if old is None and indexed_path is not None and indexed_path.decode('utf-8') != path}
+        known = dict(zip(candidates.values(), r.hmget(redis_images_meta, list(candidates.values())))) if candidates else {}
+
+        pipe.sadd(seen_key, *paths)
+        pipe.expire(seen_key, 24 * 3600)
+        for (path, meta), old in zip(chunk, map(_decode_meta, previous)):
+            if old is None:
+                old_path = candidates.get(path)
+                if old_path is not None and known.get(old_path) is not None:
+                    deferred.append((path, meta, old_path))
+                    continue
+                pipe.hset(redis_images_meta, path, json.dumps(meta))
+                pipe.hset(redis_images_index, meta['md5'], path)
+                emit('add', meta['md5'], path)
+            elif old != meta:
+                # New content at an existing path: the old md5 is resolved with the other dropped ones at the end
+                pipe.hset(redis_images_meta, path, json.dumps(meta))
+                pipe.hset(redis_images_index, meta['md5'], path)
+                if old['md5'] != meta['md5']:
+                    pipe.sadd(dropped_key, old['md5'])
+                emit('modify', meta['md5'], path, old_path=path, old_md5=old['md5'])
+
+        chunk.clear()
+        flush()
+
+    for file in drive_files:
+        if file.get("MimeType") != "image/jpeg":
+            continue
+        stats['seen'] += 1
+
+        meta = {'md5': file.get('Hashes').get('MD5'), 'size': file.get('Size'), 'mtime': file.get('ModTime')}
+        chunk.append((file.get('Path'), meta))
+        if len(chunk) >= chunk_size:
+            write_chunk()
+
+    if chunk:
+        write_chunk()
+
+    logger.debug(f"{stats['seen']} images listed in {time.monotonic() - start:.1f}s, resolving moves and deletes....")
+
+    # Paths we had last time that weren't listed
+    gone = {}
+    for paths in _scan_batches(r, redis_images_meta, chunk_size):
+        lookup = r.pipeline(transaction=False)
+        for path, _ in paths:
+            lookup.sismember(seen_key, path)
+        gone.update((path.decode('utf-8'), json.loads(meta)) for (path, meta), listed in zip(paths, lookup.execute()) if not listed)
+
+    def flush_if_full():
+        if len(pipe) >= chunk_size:
+            flush()
+
+    # Moved if the content the new path has disappeared from its old path, otherwise a copy
+    for path, meta, old_path in deferred:
+        old = gone.pop(old_path, None)
+        if old is not None and old['md5'] == meta['md5']:
+            pipe.hdel(redis_images_meta, old_path)
+            pipe.hset(redis_images_meta, path, json.dumps(meta))
+            pipe.hset(redis_images_index, meta['md5'], path)
+            emit('move', meta['md5'], path, old_path=old_path)
+        else:
+            if old is not None:
+                gone[old_path] = old
+            pipe.hset(redis_images_meta, path, json.dumps(meta))
+            pipe.hset(redis_images_index, meta['md5'], path)
+            emit('add', meta['md5'], path)
+        flush_if_full()
+
+    for path, old in gone.items():
+        pipe.hdel(redis_images_meta, path)
+        pipe.sadd(dropped_key, old['md5'])
+        emit('delete', old['md5'], path)
+        flush_if_full()
+
+    # Nothing to diff against yet: drop index entries left stale by earlier full listings
+    if first_run:
+        for entries in _scan_batches(r, redis_images_index, chunk_size):
+            metas = r.hmget(redis_images_meta, [path for _, path in entries])
+            for (md5, path), meta in zip(entries, map(_decode_meta, metas)):
+                if meta is None or meta['md5'] != md5.decode('utf-8'):
+                    pipe.hdel(redis_images_index, md5)
+                    emit('delete', md5.decode('utf-8'), path.decode('utf-8'))
+            flush_if_full()
+
+    flush()
+    _resolve_dropped(r, redis_images_index, redis_images_meta, dropped_key, chunk_size)
+    r.delete(seen_key)
+
+    logger.debug(f"Done indexing! {stats['seen']} images listed in {time.monotonic() - start:.1f}s, changes: {stats}")
+    return stats
+
+
+def _scan_batches(r, key: str, batch_size: int):
+    """
+    HSCAN a hash batch_size fields at a time
+    """
+    batch = []
+    for entry in r.hscan_iter(key, count=batch_size):
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _resolve_dropped(r, redis_images_index: str, redis_images_meta: str, dropped_key: str, batch_size: int):
+    """
+    Point every dropped md5 at a path that still has it, or remove it from the index
+    """
+    dropped = {md5.decode('utf-8') for md5 in r.smembers(dropped_key)}
+    if not dropped:
+        return
+
+    copies = {}  # md5 -> a path that still has it
+    for entries in _scan_batches(r, redis_images_meta, batch_size):
+        for path, meta in entries:
+            md5 = json.loads(meta)['md5']
+            if md5 in dropped:
+                copies.setdefault(md5, path.decode('utf-8'))
+
+    dropped = sorted(dropped)
+    indexed = r.hmget(redis_images_index, dropped)
+    still_valid = dict(zip(dropped, map(_decode_meta, r.hmget(redis_images_meta, [path or b'' for path in indexed]))))
+
+    pipe = r.pipeline()
+    for md5, indexed_path in zip(dropped, indexed):
+        if indexed_path is not None and (still_valid[md5] or {}).get('md5') == md5:
+            pass  # Already points at a path that has it
+        elif md5 in copies:
+            pipe.hset(redis_images_index, md5, copies[md5])
+        else:
+            pipe.hdel(redis_images_index, md5)
+        pipe.srem(dropped_key, md5)
+    pipe.execute()
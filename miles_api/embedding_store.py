@@ -0,0 +1,185 @@
+import os
+import json
+import fcntl
+import struct
+import pickle
+import hashlib
+import numpy as np
+
+from loguru import logger
+
+from miles_api.matcher import normalize_rows
+
+# File layout:
+#   header (128 bytes) | matrix (rows x dim) | scales (rows float32, int8 only) | names (JSON list)
+# The header's source digest is the md5 of the Redis blob the store was converted from
+MAGIC = b'MILESEMB'
+HEADER = struct.Struct('<8sBBHIIQ32s32s')
+HEADER_SIZE = 128
+FORMAT_VERSION = 2
+
+DTYPES = {'float32': 0, 'float16': 1, 'int8': 2}
+DTYPE_NAMES = {code: name for name, code in DTYPES.items()}
+
+
+def quantize(matrix, dtype):
+    """
+    Convert normalized float rows to the store dtype
+
+    return: (matrix, per-row scales or None)
+    """
+    if dtype == 'int8':
+        scales = np.abs(matrix).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    return matrix.astype(dtype), None
+
+
+def write_embedding_store(path, names, matrix, dtype='float16', source_digest=''):
+    """
+    Write normalized embeddings to a compact, memory-mappable file
+
+    The file is written next to its destination and renamed into place,
+    so readers never map a half-written store
+
+    source_digest: md5 of what the embeddings were converted from, checked by open_embedding_store
+    """
+    matrix, scales = quantize(np.ascontiguousarray(matrix, dtype=np.float32), dtype)
+    rows, dim = matrix.shape
+
+    digest = hashlib.md5(matrix.data)
+    if scales is not None:
+        digest.update(scales.data)
+    fingerprint = digest.hexdigest().encode('ascii')
+
+    names_offset = HEADER_SIZE + matrix.nbytes + (scales.nbytes if scales is not None else 0)
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, DTYPES[dtype], 0, rows, dim, names_offset, fingerprint, source_digest.encode('ascii')).ljust(HEADER_SIZE, b'\0'))
+        f.write(matrix.tobytes())
+        if scales is not None:
+            f.write(scales.tobytes())
+        f.write(json.dumps(names).encode('utf-8'))
+
+    os.replace(tmp_path, path)
+    logger.debug(f"Wrote {rows} x {dim} {dtype} embeddings to {path} ({os.path.getsize(path)} bytes)")
+
+
+class EmbeddingStore:
+    """
+    Read-only, memory-mapped view of an embedding store file
+
+    Every worker mapping the same file shares one page-cache copy
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            magic, format_version, dtype_code, _, rows, dim, names_offset, fingerprint, source_digest = read_header(f)
+            if magic != MAGIC or format_version != FORMAT_VERSION:
+                raise ValueError(f"{path} is not a v{FORMAT_VERSION} embedding store")
+
+            f.seek(names_offset)
+            self.names = json.loads(f.read().decode('utf-8'))
+
+        self.dtype = DTYPE_NAMES[dtype_code]
+        self.fingerprint = fingerprint.decode('ascii')
+        self.source_digest = source_digest.decode('ascii')
+
+        self.matrix = np.memmap(path, dtype=self.dtype, mode='r', offset=HEADER_SIZE, shape=(rows, dim))
+        self.scales = None
+        if self.dtype == 'int8':
+            self.scales = np.memmap(path, dtype=np.float32, mode='r', offset=HEADER_SIZE + self.matrix.nbytes, shape=(rows,))
+
+    def __len__(self):
+        return len(self.names)
+
+
+def read_header(f):
+    """
+    return: the unpacked header of an open store file (zeroed fields if it's too short)
+    """
+    return HEADER.unpack(f.read(HEADER.size).ljust(HEADER.size, b'\0'))
+
+
+def store_is_current(path, source_digest, dtype):
+    """
+    True if the store at path was written by this format from the same source and dtype
+    """
+    try:
+        with open(path, 'rb') as f:
+            magic, format_version, dtype_code, _, _, _, _, _, digest = read_header(f)
+    except FileNotFoundError:
+        return False
+
+    return magic == MAGIC and format_version == FORMAT_VERSION and dtype_code == DTYPES[dtype] and digest.decode('ascii') == source_digest
+
+
+def digest_key(redis_key):
+    return f"{redis_key}:digest"
+
+
+def set_profiles(r, redis_key, blob):
+    """
+    Write pickled profiles and their digest together, so readers can tell
+    whether their store is current without downloading the blob
+    """
+    pipe = r.pipeline()
+    pipe.set(redis_key, blob)
+    pipe.set(digest_key(redis_key), hashlib.md5(blob).hexdigest())
+    pipe.execute()
+
+
+def profiles_digest(r, redis_key):
+    """
+    md5 of the pickled profiles at redis_key, from the digest key next to them
+
+    Profiles written before digests existed get theirs computed once and stored
+    """
+    digest = r.get(digest_key(redis_key))
+    if digest is not None:
+        return digest.decode('ascii')
+
+    def backfill(pipe):
+        blob = pipe.get(redis_key)
+        if blob is None:
+            raise ValueError(f"No profiles at {redis_key} (promote a clustering run to create them)")
+        digest = hashlib.md5(blob).hexdigest()
+        pipe.multi()
+        pipe.set(digest_key(redis_key), digest)
+        return digest
+
+    return r.transaction(backfill, redis_key, value_from_callable=True)
+
+
+def open_embedding_store(r, redis_key, path, dtype='float16'):
+    """
+    Map the store at path, (re)converting the pickled profiles in Redis first
+    if it's missing or was converted from a different blob
+
+    Only the digest is read to check; the blob is downloaded (under a file
+    lock, so only one worker pays for it) when a conversion is needed
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    source_digest = profiles_digest(r, redis_key)
+    if store_is_current(path, source_digest, dtype):
+        return EmbeddingStore(path)
+
+    with open(f'{path}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if not store_is_current(path, source_digest, dtype):  # Another worker may have converted it while we waited
+            blob = r.get(redis_key)
+            if blob is None:
+                raise ValueError(f"No profiles at {redis_key}")
+
+            logger.debug(f"Converting {redis_key} to an embedding store....")
+            profiles = pickle.loads(blob)
+            matrix = np.asarray(list(profiles.values()), dtype=np.float32).reshape(len(profiles), -1)
+            write_embedding_store(path, list(profiles), normalize_rows(matrix), dtype, hashlib.md5(blob).hexdigest())
+
+    return EmbeddingStore(path)
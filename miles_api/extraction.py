@@ -0,0 +1,206 @@
+import os
+import time
+import asyncio
+import threading
+import numpy as np
+
+from loguru import logger
+from typing import List
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from miles_api.images import prepare_image
+from miles_api.extractor import ExtractorClient
+from miles_api.face_table import FaceTable
+from miles_api.face_maps import queue_face_images
+from miles_api.gallery import gallery_version, load_matcher
+
+
+def load_image(image_path: str, max_size: int):
+    """
+    Stage 1 (CPU, process pool): read a downloaded image and shrink it for the extractor
+
+    return: extractor payload (JPEG bytes)
+    """
+    with open(image_path, 'rb') as img:
+        return prepare_image(img.read(), max_size).payload
+
+
+class FaceLabeller:
+    """
+    Labels faces as they're extracted with the matcher /predict_label_image/ uses
+
+    New photos show up in the person -> image sets (and find_person)
+    right away; a full re-cluster is only needed now and then. The
+    matcher is reloaded whenever the gallery version changes
+    """
+
+    def __init__(self, table: FaceTable, redis_known_encodings: str, redis_faces_to_images: str, min_similarity: float):
+        self.table = table
+        self.r = table.r
+        self.redis_known_encodings = redis_known_encodings
+        self.redis_faces_to_images = redis_faces_to_images
+        self.min_similarity = min_similarity
+
+        self.version = None
+        self.matcher = None
+        self.label_index = None  # Matcher profile index -> face table label
+        self.lock = threading.Lock()  # Batches are written from several threads
+
+    def refresh(self):
+        with self.lock:
+            version = gallery_version(self.r)
+            if version != self.version:
+                self._load(version)
+
+    def _load(self, version):
+        self.version = version
+        if not self.r.exists(self.redis_known_encodings):
+            logger.warning(f"No {self.redis_known_encodings} yet, new faces stay unlabelled until clustering")
+            self.matcher, self.label_index = None, None
+            return
+
+        matcher = load_matcher(self.r, self.redis_known_encodings, version)
+
+        # Keep labels already written meaningful: only ever append to the table's names
+        positions = self.table.add_label_names(matcher.names)
+
+        self.matcher, self.label_index = matcher, np.asarray([positions[name] for name in matcher.names], dtype=np.int32)
+        logger.debug(f"Labelling new faces against gallery version {version}")
+
+    def queue(self, pipe, first_id: int, vecs, img_hashes):
+        """
+        Queue a segment's labels and its labelled images' set additions on pipe
+
+        return: faces labelled
+        """
+        self.refresh()
+        matcher, label_index = self.matcher, self.label_index  # Stay on one version for the whole segment
+        if matcher is None:
+            return 0
+
+        matches = matcher.assign(vecs, self.min_similarity)
+        known = matches >= 0
+        self.table.set_labels(pipe, first_id, np.where(known, label_index[matches], -1))
+
+        images = defaultdict(set)
+        for match, img_hash in zip(matches[known], np.asarray(img_hashes)[known]):
+            images[matcher.names[match]].add(img_hash)
+        queue_face_images(pipe, self.redis_faces_to_images, images)
+
+        return int(known.sum())
+
+
+def write_faces(table: FaceTable, results, redis_processed_images: str, labeller: FaceLabeller = None):
+    """
+    Stage 3: append a batch of faces to the face table and checkpoint its images in one transaction
+
+    With a labeller, the faces' labels and person -> image additions go in the same transaction
+
+    results: [(image hash, faces), ...]
+    return: faces labelled
+    """
+    faces = [(image_hash, face) for image_hash, image_faces in results for face in image_faces]
+    labelled = 0
+
+    pipe = table.r.pipeline()  # MULTI / EXEC: an image is only marked processed together with its faces
+    if faces:
+        first_id = table.reserve(len(faces))
+        vecs = [face['vec'] for _, face in faces]
+        img_hashes = [image_hash for image_hash, _ in faces]
+
+        table.append(pipe, first_id, vecs=vecs, boxes=[face['bbox'] for _, face in faces], img_hashes=img_hashes)
+        if labeller:
+            labelled = labeller.queue(pipe, first_id, vecs, img_hashes)
+    pipe.sadd(redis_processed_images, *[image_hash for image_hash, _ in results])
+    pipe.execute()
+
+    return labelled
+
+
+async def extract_faces(
+        r,
+        image_hashes: List[str],
+        local_download_folder: str,
+        redis_processed_images: str,
+        redis_face_table: str,
+        max_image_size: int = 1024,
+        batch_size: int = 16,
+        process_concurrency: int = None,
+        max_concurrency: int = 4,
+        client: ExtractorClient = None,
+        labeller: FaceLabeller = None,
+        on_progress=None
+):
+    """
+    Find faces in downloaded images as a pipeline of independently sized stages
+
+    Images are decoded / resized in a process pool, sent to the extractor
+    batch_size at a time (max_concurrency batches in flight over pooled
+    connections), and every finished batch is appended to the face table
+    and checkpointed in redis_processed_images, so a crashed run resumes
+    at the next batch
+
+    process_concurrency: decode / resize processes, this machine's CPU count when None
+    labeller: also label faces against the current gallery as they're written
+    on_progress: called with the number of images finished so far
+    """
+    process_concurrency = process_concurrency or os.cpu_count() or 4
+    loop = asyncio.get_running_loop()
+    own_client = client is None
+    client = client or ExtractorClient(max_concurrency=max_concurrency)
+    table = FaceTable(r, redis_face_table)
+
+    total = len(image_hashes)
+    start = time.monotonic()
+    stats = {'done': 0, 'faces': 0, 'labelled': 0, 'failed': 0}
+    batches = asyncio.Queue(maxsize=2 * max_concurrency)  # Bounds decoded images held in memory
+
+    async def prepare(pool):
+        for offset in range(0, total, batch_size):
+            chunk = image_hashes[offset:offset + batch_size]
+            payloads = await asyncio.gather(*[loop.run_in_executor(pool, load_image, f'{local_download_folder}/{image_hash}.jpg', max_image_size) for image_hash in chunk], return_exceptions=True)
+
+            batch = []
+            for image_hash, payload in zip(chunk, payloads):
+                if isinstance(payload, Exception):
+                    logger.error(f"Unable to load image {image_hash}: {payload}")  # Not checkpointed, retried next run
+                    stats['failed'] += 1
+                else:
+                    batch.append((image_hash, payload))
+            if batch:
+                await batches.put(batch)
+
+        for _ in range(max_concurrency):
+            await batches.put(None)
+
+    async def extract():
+        while (batch := await batches.get()) is not None:
+            hashes, payloads = zip(*batch)
+            try:
+                results = await client.extract(list(payloads))
+                if len(results) != len(payloads):
+                    raise ValueError(f"extractor returned {len(results)} results for {len(payloads)} images")
+            except Exception as e:
+                logger.error(f"Unable to analyze {len(batch)} images: {e}")
+                stats['failed'] += len(batch)
+                continue
+
+            stats['labelled'] += await loop.run_in_executor(None, write_faces, table, list(zip(hashes, results)), redis_processed_images, labeller)
+
+            stats['done'] += len(batch)
+            stats['faces'] += sum(len(faces) for faces in results)
+            elapsed = time.monotonic() - start
+            logger.info(f"{stats['done']}/{total} images processed, {stats['faces']} faces... ({stats['done'] / max(elapsed, 1e-6):.1f} images/sec)")
+            if on_progress:
+                on_progress(stats['done'])
+
+    try:
+        with ProcessPoolExecutor(process_concurrency) as pool:
+            await asyncio.gather(prepare(pool), *[extract() for _ in range(max_concurrency)])
+    finally:
+        if own_client:
+            await client.aclose()
+
+    logger.info(f"Done! {total} images in {time.monotonic() - start:.1f}s: {stats}")
+    return stats
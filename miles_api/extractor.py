@@ -0,0 +1,178 @@
+import json
+import httpx
+import asyncio
+
+from loguru import logger
+from base64 import b64encode
+from typing import List
+
+from miles_api.resources.default_configs import (
+    EXTRACTOR_URL,
+    EXTRACTOR_MULTIPART_URL,
+    EXTRACTOR_TIMEOUT,
+    EXTRACTOR_RETRIES,
+    EXTRACTOR_BACKOFF,
+    EXTRACTOR_MAX_CONCURRENCY,
+    EXTRACTOR_MAX_BATCH,
+    EXTRACTOR_MAX_WAIT_MS
+)
+
+
+class ExtractorError(Exception):
+    pass
+
+
+class ExtractorUnavailable(ExtractorError):
+    """
+    The extractor kept failing (5xx / transport errors) through every retry
+    """
+    pass
+
+
+class ExtractorClient:
+    """
+    Async client for the insightface /extract endpoint
+
+    Keeps a pooled connection to the extractor, caps the number of
+    requests in flight and retries transient failures with backoff
+    """
+
+    def __init__(
+            self,
+            url: str = EXTRACTOR_URL,
+            multipart_url: str = EXTRACTOR_MULTIPART_URL,
+            timeout: float = EXTRACTOR_TIMEOUT,
+            retries: int = EXTRACTOR_RETRIES,
+            backoff: float = EXTRACTOR_BACKOFF,
+            max_concurrency: int = EXTRACTOR_MAX_CONCURRENCY
+    ):
+        self.url = url
+        self.multipart_url = multipart_url
+        self.retries = retries
+        self.backoff = backoff
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 5.)),
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def extract(self, images: List[bytes]):
+        """
+        Find faces in a batch of encoded images
+
+        return: one list of faces ({'bbox': [...], 'vec': [...], ...}) per image
+        """
+        if self.multipart_url:
+            # Raw JPEG parts: no base64 inflation, no JSON encoding
+            url, request = self.multipart_url, {'files': [('images', (f'{i}.jpg', image, 'image/jpeg')) for i, image in enumerate(images)]}
+        else:
+            url, request = self.url, {'content': json.dumps({"images": {"data": [b64encode(image).decode('utf-8') for image in images]}})}
+
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    req = await self.client.post(url, **request)
+                    if req.status_code < 500:
+                        req.raise_for_status()
+                        return req.json()
+                    error = f"HTTP {req.status_code}"
+                except httpx.HTTPStatusError as e:
+                    raise ExtractorError(f"Extractor rejected the request: HTTP {e.response.status_code}") from e
+                except ValueError as e:
+                    raise ExtractorError(f"Extractor returned invalid JSON: {e}") from e
+                except httpx.TransportError as e:
+                    error = repr(e)
+
+                if attempt < self.retries:
+                    delay = self.backoff * 2 ** attempt
+                    logger.warning(f"Extractor request failed ({error}), retrying in {delay:.1f}s....")
+                    await asyncio.sleep(delay)
+
+        raise ExtractorUnavailable(f"Extractor unavailable after {self.retries + 1} attempts: {error}")
+
+
+class ExtractionBatcher:
+    """
+    Combines single-image extractions that arrive within max_wait of each
+    other into one /extract call, then hands each caller its own faces
+    """
+
+    def __init__(self, client: ExtractorClient, max_batch: int = EXTRACTOR_MAX_BATCH, max_wait_ms: float = EXTRACTOR_MAX_WAIT_MS):
+        self.client = client
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.collector = None
+        self.dispatches = set()  # Keep references so in-flight batches aren't garbage collected
+
+    def start(self):
+        self.collector = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        self.collector.cancel()
+        await asyncio.gather(self.collector, *self.dispatches, return_exceptions=True)
+
+    async def extract(self, image: bytes):
+        """
+        Find faces in a single encoded image
+
+        return: list of faces ({'bbox': [...], 'vec': [...], ...})
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Don't wait on the extractor; the client's semaphore bounds batches in flight
+            dispatch = asyncio.create_task(self._dispatch(batch))
+            self.dispatches.add(dispatch)
+            dispatch.add_done_callback(self.dispatches.discard)
+
+    async def _extract_batch(self, images):
+        results = await self.client.extract(list(images))
+        if len(results) != len(images):
+            raise ExtractorError(f"Extractor returned {len(results)} results for {len(images)} images")
+        return results
+
+    async def _dispatch(self, batch):
+        images, futures = zip(*batch)
+        logger.debug(f"Extracting batch of {len(images)} images....")
+
+        try:
+            results = await self._extract_batch(images)
+        except ExtractorUnavailable as e:
+            results = [e] * len(images)  # Splitting the batch up won't bring the extractor back
+        except Exception as e:
+            if len(images) == 1:
+                results = [e]
+            else:
+                # One bad image shouldn't fail everyone batched with it: retry each on its own
+                logger.warning(f"Batch of {len(images)} images failed ({e}), retrying them one at a time....")
+                results = await asyncio.gather(*[self._extract_batch([image]) for image in images], return_exceptions=True)
+                results = [result if isinstance(result, Exception) else result[0] for result in results]
+
+        for future, faces in zip(futures, results):
+            if future.done():  # Caller may have gone away
+                continue
+            if isinstance(faces, Exception):
+                future.set_exception(faces)
+            else:
+                future.set_result(faces)
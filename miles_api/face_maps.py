@@ -0,0 +1,144 @@
+import json
+
+from collections import defaultdict
+from loguru import logger
+
+# faces_to_images used to be one hash of name -> JSON list of image hashes, rewritten on every
+# append. Each person now gets a set ({key}:person:{name}), and {key}:people holds every name.
+
+
+def people_key(key: str):
+    return f"{key}:people"
+
+
+def person_key(key: str, name: str):
+    return f"{key}:person:{name}"
+
+
+def queue_face_images(pipe, key: str, images: dict):
+    """
+    Queue SADDs for {person name: image hashes} on pipe
+    """
+    images = {name: img_hashes for name, img_hashes in images.items() if img_hashes}
+    if not images:
+        return
+    pipe.sadd(people_key(key), *images)
+    for name, img_hashes in images.items():
+        pipe.sadd(person_key(key, name), *img_hashes)
+
+
+def add_face_images(r, key: str, pairs, batch_size: int = 10000):
+    """
+    Record (person name, image hash) pairs with pipelined SADDs
+
+    Adding is idempotent and order-free, so concurrent writers never
+    lose each other's images
+
+    return: pairs written
+    """
+    written = 0
+    pending = defaultdict(set)
+
+    def flush():
+        pipe = r.pipeline(transaction=False)
+        queue_face_images(pipe, key, pending)
+        pipe.execute()
+        pending.clear()
+
+    for name, img_hash in pairs:
+        pending[name].add(img_hash)
+        written += 1
+        if written % batch_size == 0:
+            flush()
+
+    if pending:
+        flush()
+
+    return written
+
+
+def clear_face_images(r, key: str):
+    """
+    Drop every person set, and the legacy JSON hash at key, before a full rebuild
+
+    The legacy hash has to go too: person_names / iter_person_images would
+    otherwise keep merging its stale labels into the rebuilt sets
+    """
+    pipe = r.pipeline(transaction=False)
+    for name in r.sscan_iter(people_key(key)):
+        pipe.delete(person_key(key, name.decode('utf-8')))
+    pipe.delete(people_key(key))
+    if r.type(key) == b'hash':
+        pipe.delete(key)
+    pipe.execute()
+
+
+def person_names(r, key: str):
+    """
+    Every person with images, from the sets and the legacy hash
+    """
+    names = {name.decode('utf-8') for name in r.sscan_iter(people_key(key))}
+    if r.type(key) == b'hash':
+        names.update(name.decode('utf-8') for name in r.hkeys(key))
+    return names
+
+
+def iter_person_images(r, key: str, name: str, count: int = 1000):
+    """
+    Image hashes of one person, streamed with SSCAN
+
+    Also yields what's still in the legacy JSON hash for them (until
+    migrate_legacy_face_images has run), so adding to a person's set
+    never hides their older photos
+    """
+    seen = set()
+    for img_hash in r.sscan_iter(person_key(key, name), count=count):
+        img_hash = img_hash.decode('utf-8')
+        seen.add(img_hash)
+        yield img_hash
+
+    if r.type(key) == b'hash':
+        legacy = [img_hash for img_hash in json.loads(r.hget(key, name) or '[]') if img_hash not in seen]
+        if legacy:
+            logger.debug(f"{len(legacy)} of {name}'s images are only in legacy {key}")
+        yield from legacy
+
+
+def migrate_legacy_face_images(r, key: str, batch_size: int = 1000):
+    """
+    One-shot move of the legacy {name: JSON list} hash at key into per-person sets
+
+    Each field is SADDed and HDELed in the same transaction, so the
+    migration can be interrupted and re-run safely
+
+    return: people migrated
+    """
+    if r.type(key) != b'hash':
+        logger.info(f"Nothing to migrate: {key} is not a legacy hash")
+        return 0
+
+    migrated = 0
+    fields = list(r.hkeys(key))
+    for offset in range(0, len(fields), batch_size):
+        batch = fields[offset:offset + batch_size]
+
+        pipe = r.pipeline()
+        for name, images in zip(batch, r.hmget(key, batch)):
+            if images is None:
+                continue
+            queue_face_images(pipe, key, {name.decode('utf-8'): set(json.loads(images))})
+            pipe.hdel(key, name)
+            migrated += 1
+        pipe.execute()
+
+        logger.info(f"Migrated {migrated}/{len(fields)} people from {key}")
+
+    return migrated
+
+
+if __name__ == '__main__':
+    # python -m miles_api.face_maps [faces_to_images key]
+    import sys
+    from miles_api.redis import r
+
+    migrate_legacy_face_images(r, sys.argv[1] if len(sys.argv) > 1 else 'faces_to_images')
@@ -0,0 +1,143 @@
+import json
+import numpy as np
+
+from loguru import logger
+
+BOX_DTYPE = np.float32
+VEC_DTYPE = np.float32
+IMG_HASH_DTYPE = 'S32'  # MD5 hex digests
+LABEL_DTYPE = np.int32  # Index into {key}:label_names, -1 for unknown faces
+
+
+class FaceTable:
+    """
+    Append-only columnar table of every face found, stored as Redis strings
+
+    Each append is a segment of three raw arrays: embeddings (float32,
+    rows x dim), boxes (float32, rows x 4) and image hashes (S32).
+    Faces get stable row ids from an INCRBY counter, segments are listed
+    in a sorted set scored by their first row id, so loads come back in
+    row order and go straight into NumPy with np.frombuffer (no unpickling)
+
+    Labels from clustering are an optional fourth column, written per
+    segment as they're assigned
+
+    Keys: {key}:next_id, {key}:dim, {key}:segments, {key}:{vec,box,img,label}:{first id}, {key}:label_names
+    """
+
+    def __init__(self, r, key: str):
+        self.r = r
+        self.key = key
+
+    def _column_key(self, column: str, first_id: int):
+        return f"{self.key}:{column}:{first_id}"
+
+    @property
+    def segments_key(self):
+        return f"{self.key}:segments"
+
+    def dim(self):
+        dim = self.r.get(f"{self.key}:dim")
+        return int(dim) if dim is not None else None
+
+    def __len__(self):
+        return sum(int(member.split(b':')[1]) for member in self.r.zrange(self.segments_key, 0, -1))
+
+    def reserve(self, rows: int):
+        """
+        Claim row ids for a segment about to be written
+
+        return: first row id (ids lost to a crash are never reused)
+        """
+        return self.r.incrby(f"{self.key}:next_id", rows) - rows
+
+    def append(self, pipe, first_id: int, vecs, boxes, img_hashes):
+        """
+        Queue a segment on pipe (so callers can commit it with their own checkpoint)
+        """
+        vecs = np.ascontiguousarray(vecs, dtype=VEC_DTYPE)
+        boxes = np.ascontiguousarray(boxes, dtype=BOX_DTYPE).reshape(-1, 4)
+        img_hashes = np.asarray(img_hashes, dtype=IMG_HASH_DTYPE)
+
+        pipe.setnx(f"{self.key}:dim", vecs.shape[1])
+        pipe.set(self._column_key('vec', first_id), vecs.tobytes())
+        pipe.set(self._column_key('box', first_id), boxes.tobytes())
+        pipe.set(self._column_key('img', first_id), img_hashes.tobytes())
+        pipe.zadd(self.segments_key, {f"{first_id}:{len(vecs)}": first_id})
+
+    def set_labels(self, pipe, first_id: int, labels):
+        """
+        Queue a segment's labels on pipe
+        """
+        pipe.set(self._column_key('label', first_id), np.asarray(labels, dtype=LABEL_DTYPE).tobytes())
+
+    def add_label_names(self, names):
+        """
+        Append names the label list doesn't have yet, atomically (WATCH / MULTI)
+
+        The list only ever grows, so labels already written by anyone keep their meaning
+
+        return: {name: label} for the whole list
+        """
+        key = f"{self.key}:label_names"
+
+        def append(pipe):
+            current = json.loads(pipe.get(key) or '[]')
+            known = set(current)
+            new = [name for name in dict.fromkeys(names) if name not in known]
+
+            pipe.multi()
+            if new:
+                pipe.set(key, json.dumps(current + new))
+            return current + new
+
+        all_names = self.r.transaction(append, key, value_from_callable=True)
+        return {name: label for label, name in enumerate(all_names)}
+
+    def label_names(self):
+        names = self.r.get(f"{self.key}:label_names")
+        return json.loads(names) if names is not None else []
+
+    def iter_segments(self, start_id: int = 0, segments_per_fetch: int = 64):
+        """
+        Stream the table one segment at a time (bounded memory)
+
+        yield: row ids, embeddings, boxes, image hashes; read-only views over the fetched bytes
+        """
+        dim = self.dim()
+        members = self.r.zrangebyscore(self.segments_key, start_id, '+inf')
+
+        for offset in range(0, len(members), segments_per_fetch):
+            segments = [tuple(int(part) for part in member.split(b':')) for member in members[offset:offset + segments_per_fetch]]
+
+            pipe = self.r.pipeline(transaction=False)
+            for first_id, _ in segments:
+                for column in ('vec', 'box', 'img'):
+                    pipe.get(self._column_key(column, first_id))
+            columns = pipe.execute()
+
+            for i, (first_id, rows) in enumerate(segments):
+                vecs, boxes, img_hashes = columns[3 * i:3 * i + 3]
+                if vecs is None:
+                    logger.warning(f"Segment {first_id} of {self.key} is missing, skipping {rows} faces")
+                    continue
+
+                yield (
+                    np.arange(first_id, first_id + rows, dtype=np.int64),
+                    np.frombuffer(vecs, dtype=VEC_DTYPE).reshape(rows, dim),
+                    np.frombuffer(boxes, dtype=BOX_DTYPE).reshape(rows, 4),
+                    np.frombuffer(img_hashes, dtype=IMG_HASH_DTYPE)
+                )
+
+    def load(self, start_id: int = 0):
+        """
+        Whole table (from start_id) as contiguous arrays, in row id order
+
+        return: row ids, embeddings, boxes, image hashes
+        """
+        dim = self.dim() or 0
+        segments = list(self.iter_segments(start_id))
+        if not segments:
+            return np.empty(0, np.int64), np.empty((0, dim), VEC_DTYPE), np.empty((0, 4), BOX_DTYPE), np.empty(0, IMG_HASH_DTYPE)
+
+        return tuple(np.concatenate(column) for column in zip(*segments))
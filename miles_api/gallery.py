@@ -0,0 +1,156 @@
+import os
+import asyncio
+
+from loguru import logger
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from miles_api.matcher import FaceMatcher
+from miles_api.names import NameIndex
+from miles_api.face_maps import person_names
+from miles_api.embedding_store import open_embedding_store
+from miles_api.resources.default_configs import (
+    EMBEDDING_STORE_DIR,
+    EMBEDDING_STORE_DTYPE,
+    GALLERY_VERSION_KEY,
+    GALLERY_POLL_INTERVAL
+)
+
+
+def bump_gallery_version(r, version_key=GALLERY_VERSION_KEY):
+    """
+    Tell every API worker to reload (call after writing new encodings / maps)
+    """
+    return r.incr(version_key)
+
+
+def gallery_version(r, version_key=GALLERY_VERSION_KEY):
+    version = r.get(version_key)
+    return version.decode('utf-8') if version is not None else '0'
+
+
+def load_matcher(r, redis_known_encodings: str, version: str):
+    """
+    Matcher over known_encodings at a gallery version (blocking)
+
+    Shared by the API's gallery and the workers labelling new faces, so both match the same way
+    """
+    store_path = os.path.join(EMBEDDING_STORE_DIR, f"{redis_known_encodings}_{version}.emb")
+    profiles = open_embedding_store(r, redis_known_encodings, store_path, EMBEDDING_STORE_DTYPE)
+    matcher = FaceMatcher.from_store(profiles)
+    matcher.attach_index(r, f"{redis_known_encodings}_index")
+    return matcher
+
+
+class Gallery:
+    """
+    One consistent snapshot of everything predict / find_person read
+    """
+
+    def __init__(self, version: str, matcher: FaceMatcher, all_profiles: list, image_count: int):
+        self.version = version
+        self.matcher = matcher
+        self.all_profiles = all_profiles
+        self.image_count = image_count  # Paths are read from images_index with HMGET when a job needs them
+        self.names = NameIndex(all_profiles)  # For find_person lookups
+
+
+class GalleryManager:
+    """
+    Loads gallery snapshots lazily and swaps in a new one in the background
+    whenever the version key in Redis changes
+
+    Requests grab the current snapshot once and keep using it, so a swap
+    never mixes old and new data inside one request
+    """
+
+    def __init__(
+            self,
+            r,
+            redis_known_encodings: str,
+            redis_faces_to_images: str,
+            redis_images_index: str,
+            version_key: str = GALLERY_VERSION_KEY,
+            poll_interval: float = GALLERY_POLL_INTERVAL,
+            on_swap=None
+    ):
+        self.r = r
+        self.redis_known_encodings = redis_known_encodings
+        self.redis_faces_to_images = redis_faces_to_images
+        self.redis_images_index = redis_images_index
+        self.version_key = version_key
+        self.poll_interval = poll_interval
+        self.on_swap = on_swap or []
+
+        self.gallery: Optional[Gallery] = None
+        self.loading: Optional[asyncio.Task] = None
+        self.poller: Optional[asyncio.Task] = None
+
+    def remote_version(self):
+        return gallery_version(self.r, self.version_key)
+
+    def load(self, version: str):
+        """
+        Build a full snapshot (blocking, run it off the event loop)
+        """
+        logger.debug(f"Loading gallery version {version}....")
+
+        matcher = load_matcher(self.r, self.redis_known_encodings, version)
+
+        # Everyone the matcher knows, too: FaceLabeller can give them their first photos without a gallery bump
+        all_profiles = sorted(person_names(self.r, self.redis_faces_to_images) | set(matcher.names))  # Images are read per person, when needed
+        image_count = self.r.hlen(self.redis_images_index)
+
+        logger.debug(f"Gallery {version}: {len(matcher)} encodings, {len(all_profiles)} profiles, {image_count} images")
+        return Gallery(version, matcher, all_profiles, image_count)
+
+    async def get(self) -> Gallery:
+        """
+        Current snapshot, waiting for the first load if there isn't one yet
+        """
+        if self.gallery is None:
+            await self.refresh()
+        return self.gallery
+
+    async def refresh(self):
+        """
+        Load the remote version if it differs from ours; concurrent callers share one load
+        """
+        if self.loading is None or self.loading.done():
+            self.loading = asyncio.create_task(self._refresh())
+        await asyncio.shield(self.loading)
+
+    async def _refresh(self):
+        version = await run_in_threadpool(self.remote_version)
+        if self.gallery is not None and version == self.gallery.version:
+            return
+
+        gallery = await run_in_threadpool(self.load, version)
+        previous, self.gallery = self.gallery, gallery  # Atomic swap
+        logger.info(f"Now serving gallery version {version}")
+
+        for callback in self.on_swap:
+            callback(gallery)
+
+        # Workers still mapping the old store keep their pages until they swap too
+        if previous is not None:
+            try:
+                os.remove(os.path.join(EMBEDDING_STORE_DIR, f"{self.redis_known_encodings}_{previous.version}.emb"))
+            except OSError:
+                pass
+
+    def start(self):
+        self.poller = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self.poller is not None:
+            self.poller.cancel()
+
+    async def _poll(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Unable to reload gallery: {e}")  # Keep serving the current snapshot
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,99 @@
+from html import escape
+from io import BytesIO
+from PIL import Image, ImageDraw
+
+from miles_api.resources.default_configs import PREDICT_MAX_IMAGE_SIZE
+
+JPEG_MODES = ('RGB', 'L')
+
+
+class PreparedImage:
+    """
+    An upload ready to send to the extractor
+
+    payload is what the extractor sees (the original bytes whenever they
+    are already a small enough JPEG); face boxes come back in its coordinates
+    """
+
+    def __init__(self, payload: bytes, size, image: Image.Image = None):
+        self.payload = payload
+        self.size = size
+        self._image = image
+
+    def decode(self):
+        """
+        RGB pixels matching payload, decoded at most once
+        """
+        if self._image is None:
+            self._image = Image.open(BytesIO(self.payload)).convert('RGB')
+        return self._image
+
+
+def prepare_image(data: bytes, max_size: int = PREDICT_MAX_IMAGE_SIZE):
+    """
+    Turn raw upload bytes into an extractor payload with as little work as possible
+
+    Small JPEGs are forwarded untouched. Large JPEGs are decoded with
+    draft() at a reduced DCT scale, everything else is decoded once; both
+    are shrunk to max_size and encoded a single time.
+    """
+    image = Image.open(BytesIO(data))  # Only parses the header
+
+    if image.format == 'JPEG' and image.mode in JPEG_MODES and max(image.size) <= max_size:
+        return PreparedImage(data, image.size)
+
+    if image.format == 'JPEG':
+        image.draft('RGB', (max_size, max_size))  # Decode at 1/2, 1/4 or 1/8 scale when possible
+
+    image = image.convert('RGB')  # Drop alpha / palette
+    image.thumbnail((max_size, max_size))
+
+    payload = BytesIO()
+    image.save(payload, format='JPEG', quality=90)
+    return PreparedImage(payload.getvalue(), image.size, image)
+
+
+def annotate(image: Image.Image, faces, labels):
+    """
+    Draw a labelled box around every face
+
+    return: JPEG bytes
+    """
+    draw = ImageDraw.Draw(image)
+
+    for face, label in zip(faces, labels):
+        left, top, right, bottom = face['bbox']
+
+        # Draw a box around the face using the Pillow module
+        draw.rectangle(((left, top), (right, bottom)), outline=(0, 0, 255))
+
+        # Draw a label with a name below the face
+        _, _, text_width, text_height = draw.textbbox((0, 0), label)
+        draw.rectangle(((left, bottom - text_height - 10), (right, bottom)), fill=(0, 0, 255), outline=(0, 0, 255))
+        draw.text((left + 6, bottom - text_height - 5), label, fill=(255, 255, 255, 255))
+
+    del draw
+
+    # Save it into a bytes stream
+    output_image_stream = BytesIO()
+    image.save(output_image_stream, format='JPEG')
+    return output_image_stream.getvalue()
+
+
+def svg_overlay(size, faces, labels):
+    """
+    The same boxes and labels as annotate(), as an SVG to lay over the image client-side
+
+    The viewBox is the extractor image size, so it lines up at any display size
+    """
+    width, height = size
+    shapes = []
+
+    for face, label in zip(faces, labels):
+        left, top, right, bottom = face['bbox']
+        shapes.append(
+            f'<rect x="{left}" y="{top}" width="{right - left}" height="{bottom - top}" fill="none" stroke="#0000ff"/>'
+            f'<text x="{left + 6}" y="{bottom - 5}" fill="#ffffff" stroke="#0000ff" paint-order="stroke">{escape(label)}</text>'
+        )
+
+    return f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}">{"".join(shapes)}</svg>'
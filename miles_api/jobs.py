@@ -0,0 +1,156 @@
+import json
+import time
+import uuid
+
+from loguru import logger
+from typing import Optional
+
+from miles_api.resources.default_configs import (
+    JOBS_PREFIX,
+    JOBS_TTL,
+    JOBS_MAX_ATTEMPTS,
+    WORKER_HEARTBEAT_TTL
+)
+
+
+class Job:
+    """
+    Handle a running task uses to checkpoint its progress
+
+    Everything lands in the job's Redis hash, which /jobs/{id} returns
+    """
+
+    def __init__(self, r, job_id: str, key: str, kind: str, payload: dict):
+        self.r = r
+        self.id = job_id
+        self.key = key
+        self.kind = kind
+        self.payload = payload
+
+    def update(self, **fields):
+        self.r.hset(self.key, mapping={field: value if isinstance(value, (str, int, float)) else json.dumps(value) for field, value in fields.items()})
+
+    def incr(self, field: str, amount: int = 1):
+        return self.r.hincrby(self.key, field, amount)
+
+    def progress(self, processed: int, total: Optional[int] = None):
+        """
+        Record items processed so far (and the total, once known) for throughput reporting
+        """
+        fields = {'processed': processed, 'updated': time.time()}
+        if total is not None:
+            fields['total'] = total
+        self.update(**fields)
+
+
+class JobQueue:
+    """
+    Redis-backed queue of long-running tasks
+
+    A job lives in a hash ({prefix}:job:{id}). Workers atomically move job
+    ids from the queue to their own processing list, so a job a worker
+    was running when it died can be put back and resumed by another one.
+    """
+
+    def __init__(self, r, prefix: str = JOBS_PREFIX):
+        self.r = r
+        self.prefix = prefix
+        self.queue_key = f"{prefix}:queue"
+
+    def job_key(self, job_id):
+        return f"{self.prefix}:job:{job_id}"
+
+    def processing_key(self, worker_name):
+        return f"{self.prefix}:processing:{worker_name}"
+
+    def heartbeat_key(self, worker_name):
+        return f"{self.prefix}:worker:{worker_name}"
+
+    def submit(self, kind: str, payload: dict, **fields):
+        job_id = uuid.uuid4().hex
+
+        pipe = self.r.pipeline()
+        pipe.hset(self.job_key(job_id), mapping={'id': job_id, 'kind': kind, 'payload': json.dumps(payload), 'status': 'queued', 'attempts': 0, 'created': time.time(), **fields})
+        pipe.lpush(self.queue_key, job_id)
+        pipe.execute()
+
+        logger.debug(f"Queued {kind} job {job_id}")
+        return job_id
+
+    def get(self, job_id: str):
+        """
+        Job status, progress and throughput (None if unknown)
+        """
+        job = {field.decode('utf-8'): value.decode('utf-8') for field, value in self.r.hgetall(self.job_key(job_id)).items()}
+        if not job:
+            return None
+
+        job['payload'] = json.loads(job['payload'])
+        if 'started' in job and 'processed' in job:
+            elapsed = float(job.get('finished') or time.time()) - float(job['started'])
+            job['throughput'] = round(int(job['processed']) / max(elapsed, 1e-6), 2)  # Items / sec
+        if job['status'] == 'queued':
+            job['queue_length'] = self.r.llen(self.queue_key)
+
+        return job
+
+    def reserve(self, worker_name: str, timeout: int = 5):
+        """
+        Block until a job is available and claim it for this worker
+        """
+        job_id = self.r.brpoplpush(self.queue_key, self.processing_key(worker_name), timeout=timeout)
+        if job_id is None:
+            return None
+
+        job_id = job_id.decode('utf-8')
+        key = self.job_key(job_id)
+        kind, payload = self.r.hmget(key, 'kind', 'payload')
+
+        pipe = self.r.pipeline()
+        pipe.hset(key, mapping={'status': 'running', 'worker': worker_name, 'started': time.time()})
+        pipe.hincrby(key, 'attempts', 1)
+        pipe.execute()
+
+        return Job(self.r, job_id, key, kind.decode('utf-8'), json.loads(payload))
+
+    def finish(self, worker_name: str, job: Job, error: Optional[str] = None):
+        pipe = self.r.pipeline()
+        pipe.hset(job.key, mapping={'status': 'failed' if error else 'done', 'finished': time.time(), **({'error': error} if error else {})})
+        pipe.expire(job.key, JOBS_TTL)
+        pipe.lrem(self.processing_key(worker_name), 1, job.id)
+        pipe.execute()
+
+    def heartbeat(self, worker_name: str):
+        self.r.set(self.heartbeat_key(worker_name), time.time(), ex=WORKER_HEARTBEAT_TTL)
+
+    def recover(self, worker_name: str, max_attempts: int = JOBS_MAX_ATTEMPTS):
+        """
+        Requeue jobs claimed by workers that stopped heart-beating, and our own from a previous run
+
+        A job that has already been started max_attempts times is marked
+        failed instead, so one that keeps killing its worker isn't retried forever
+        """
+        for processing_key in self.r.scan_iter(f"{self.prefix}:processing:*"):
+            owner = processing_key.decode('utf-8').rsplit(':', maxsplit=1)[-1]
+            if owner != worker_name and self.r.exists(self.heartbeat_key(owner)):
+                continue
+
+            while (job_id := self.r.lindex(processing_key, -1)) is not None:
+                job_id = job_id.decode('utf-8')
+                key = self.job_key(job_id)
+                attempts = int(self.r.hget(key, 'attempts') or 0)
+
+                pipe = self.r.pipeline()
+                pipe.lrem(processing_key, -1, job_id)
+                if attempts >= max_attempts:
+                    pipe.hset(key, mapping={'status': 'failed', 'finished': time.time(), 'error': f"Worker died {attempts} times while running this job"})
+                    pipe.expire(key, JOBS_TTL)
+                else:
+                    pipe.hset(key, 'status', 'queued')
+                    pipe.lpush(self.queue_key, job_id)
+                pipe.execute()
+
+                if attempts >= max_attempts:
+                    logger.error(f"Job {job_id} from {owner} failed after {attempts} attempts")
+                else:
+                    logger.info(f"Requeued job {job_id} from {owner} (attempt {attempts}/{max_attempts})")
@@ -1,92 +1,88 @@
 import json
-import subprocess
-import magic
-import os
-import pickle
-import re
-import numpy as np
-from sklearn.metrics import pairwise
 import asyncio
-import requests
 
-from numpy.linalg import norm
-from redis import Redis
-from fuzzywuzzy import process as fz_process
-from io import BytesIO
-from PIL import Image, ImageDraw
 from loguru import logger
 from fastapi import FastAPI
-from fastapi import BackgroundTasks, File, UploadFile, Response
+from fastapi import File, UploadFile, Response, HTTPException
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel, validator
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
 from typing import Optional, List
 from base64 import b64encode
 from io import BytesIO
 
-REDIS_HOST = os.environ.get('REDIS_HOST')
-redis_args = [REDIS_HOST]
-if ":" in REDIS_HOST:
-    redis_args = REDIS_HOST.split(':')
-
-r = Redis(*redis_args)
-
-version = os.environ.get('version') or '10'
+from miles_api.extractor import ExtractorClient, ExtractionBatcher, ExtractorError
+from miles_api.images import prepare_image, annotate, svg_overlay
+from miles_api.cache import FaceCache, image_hash
+from miles_api.gallery import GalleryManager, bump_gallery_version
+from miles_api.redis import r
+from miles_api.jobs import JobQueue
+from miles_api.tasks import IndexDriveInfo, DownloadDriveInfo, ProcessImagesInfo, ClusterFacesInfo, FindPerson
+from miles_api.resources.default_configs import (
+    VERSION as version,
+    PREDICT_CACHE_BACKEND,
+    PREDICT_MAX_IMAGE_SIZE
+)
 
 app = FastAPI()
 
-mime = magic.Magic(mime=True)
-
-profiles = pickle.loads(r.get('known_encodings'))
-logger.debug(f'Loaded {len(profiles)} profiles....')
+# Indexing, downloads and find_person run on miles_api.worker processes
+jobs = JobQueue(r)
 
-# Pull profiles
-# all_profiles = {name.decode('utf-8'): images.decode('utf-8') for name, images in r.hgetall(find_person_info.redis_faces_to_images).items()}
-# images_index = {img_hash.decode('utf-8'): path.decode('utf-8') for img_hash, path in r.hgetall(find_person_info.redis_images_index).items()}
+face_cache = FaceCache(r)
 
-all_profiles = {name.decode('utf-8'): images.decode('utf-8') for name, images in r.hgetall("faces_to_images").items()}
-images_index = {img_hash.decode('utf-8'): path.decode('utf-8') for img_hash, path in r.hgetall("images_index_10").items()}
+# Profiles, name -> images map and image index, reloaded in the background when gallery_version changes
+galleries = GalleryManager(
+    r,
+    redis_known_encodings='known_encodings',
+    redis_faces_to_images='faces_to_images',
+    redis_images_index=f'images_index_{version}',
+    on_swap=[lambda gallery: face_cache.invalidate()]
+)
 
+extractor: Optional[ExtractorClient] = None
+batcher: Optional[ExtractionBatcher] = None
 
-logger.debug(f"Profiles loaded: {len(all_profiles)}")
-logger.debug(f"Images loaded: {len(images_index)}")
 
+@app.on_event('startup')
+async def start_background_services():
+    global extractor, batcher
+    extractor = ExtractorClient()
+    batcher = ExtractionBatcher(extractor)
+    batcher.start()
 
-#################################
-#        Compare Faces          #
-#################################
-
+    # Don't block readiness on loading the gallery; the first request waits for it if needed
+    galleries.start()
 
-def compare_faces(f1, f2):
 
-    def normalize(embedding):
-        embedding_norm = norm(embedding)
-        normed_embedding = embedding / embedding_norm
-        return normed_embedding
+@app.on_event('shutdown')
+async def stop_background_services():
+    await galleries.stop()
+    await batcher.stop()
+    await extractor.aclose()
 
-    f1 = normalize(f1)
-    f2 = normalize(f2)
 
-    return (1. + np.dot(f1, f2)) / 2
-
-
-def find_closest_match(profiles, f1):
-    dists = np.array([compare_faces(profile, f1) for profile in profiles.values()])
-
-    # closest_match = np.argmax(dists)
-
-    # Get 3 closest matches
-    closest_matches = dists.argsort()[-3:][::-1]
-    profile_names = list(profiles)
+#################################
+#           Gallery             #
+#################################
 
-    results = []
-    for match in closest_matches:
 
-        profile = profile_names[match]
-        score = round(100 * dists[match], 2)
+@app.get('/gallery/')
+async def gallery_info():
+    gallery = await galleries.get()
+    return {
+        'gallery_version': gallery.version,
+        'encodings': len(gallery.matcher),
+        'profiles': len(gallery.all_profiles),
+        'images': gallery.image_count,
+    }
 
-        results.append([profile, score])
 
-    return results
+@app.post('/gallery/reload/')
+async def reload_gallery():
+    bump_gallery_version(r)
+    await galleries.refresh()
+    return {'gallery_version': galleries.gallery.version}
 
 
 #################################
@@ -94,209 +90,42 @@ def find_closest_match(profiles, f1):
 #################################
 
 
-class IndexDriveInfo(BaseModel):
-    rclone_drive: str
-    path: str
-    redis_images_index: Optional[str] = f"images_index_{version}"
-
-    @validator('path')
-    def no_leading_trailing_slash(cls, v):
-        return v.strip('/')
-
-
 @app.post('/update_image_index/')
-async def index_drive(drive_info: IndexDriveInfo, background_tasks: BackgroundTasks):
-    background_tasks.add_task(index_drive_process, drive_info)
-    return {'message': f"Indexing path: {drive_info.rclone_drive}:{drive_info.path}..."}
-
-
-def index_drive_process(drive_info: IndexDriveInfo):
-    """
-    Grabs all image metadata from Google drive
-
-    Pushes it to a Redis DB
-    """
-
-    logger.debug(f"Fetching photos from {drive_info.rclone_drive}")
-    drive_files = json.loads(subprocess.run(['rclone', 'lsjson', f'{drive_info.rclone_drive}:/{drive_info.path}', '--files-only', '--hash', '--no-modtime', '--recursive'], stdout=subprocess.PIPE).stdout)
-
-    images_processed = 0
-    for file in drive_files:
-        if (file.get("MimeType") == "image/jpeg"):
-            # Logging / stats
-            images_processed += 1
-            logger.debug(f"{images_processed} images processed...") if images_processed % 100 == 0 else ()  # Log increments of 100
-
-            # Grab metadata
-            file_hash = file.get('Hashes').get('MD5')
-            file_path = file.get('Path')
-
-            # Store data on our image in Redis
-            r.hset(drive_info.redis_images_index, file_hash, file_path)
-
-    logger.debug(f'Done indexing! {images_processed} images indexed.')
+async def index_drive(drive_info: IndexDriveInfo):
+    job_id = jobs.submit('index_drive', drive_info.dict())
+    return {'message': f"Indexing path: {drive_info.rclone_drive}:{drive_info.path}...", 'job_id': job_id}
 
 
 #################################
 #        Download Images        #
 #################################
 
-class DownloadDriveInfo(BaseModel):
-    rclone_drive: str
-    path: str
-    local_download_folder: str
-    redis_images_index: Optional[str] = f"images_index_{version}"
-    redis_downloaded_images: Optional[str] = f"downloaded_images_{version}"
-    redis_skipped_images: Optional[str] = f"skipped_images_{version}"
-    max_image_size: Optional[tuple] = (1024, 1024)
-
-    @validator('path')
-    def no_leading_trailing_slash(cls, v):
-        return v.strip('/')
-
-
 @app.post('/download_training_images/')
-async def download_training_files(drive_info: DownloadDriveInfo, background_tasks: BackgroundTasks):
-    background_tasks.add_task(download_training_files_process, drive_info)
-    return {'message': f"Downloading from path: {drive_info.rclone_drive}:{drive_info.path}..."}
-
-
-def download_training_files_process(drive_info: DownloadDriveInfo):
-    """
-    Downloads images from our index, store them in training folder
-    """
-
-    try:
-        os.mkdir(drive_info.local_download_folder)
-    except FileExistsError:
-        pass
-
-    # Pull our whole image index
-    images = r.hgetall(drive_info.redis_images_index)
-    all_images = len(images)
-
-    # Remove downloaded / skipped images
-    [images.pop(downloaded_image, None) for downloaded_image in r.smembers(drive_info.redis_downloaded_images)]
-    [images.pop(skipped_image, None) for skipped_image in r.hkeys(drive_info.redis_skipped_images)]
-
-    # Decode our values
-    images = {image_hash.decode('utf-8'): image_path.decode('utf-8') for image_hash, image_path in images.items()}
-
-    new_images = len(images)
+async def download_training_files(drive_info: DownloadDriveInfo):
+    job_id = jobs.submit('download_training_images', drive_info.dict())
+    return {'message': f"Downloading from path: {drive_info.rclone_drive}:{drive_info.path}...", 'job_id': job_id}
 
-    logger.info(f"Already processed {all_images - new_images}...")
 
-    for img_num, (image_hash, image_name) in enumerate(images.items(), start=1):
-        logger.debug(f"downloading: {drive_info.rclone_drive}:/{drive_info.path}/{image_name}")
-        download = subprocess.run(['rclone', 'copyto', fr'{drive_info.rclone_drive}:/{drive_info.path}/{image_name}', f"{drive_info.local_download_folder}/{image_hash}"]).returncode
+#################################
+#        Process Images         #
+#################################
 
-        # Double check we downloaded correctly
-        if download != 0:
-            logger.error(f'Skipped image: {image_name}! Unable to download....')
-            r.hset(drive_info.redis_skipped_images, image_hash, "unable to download")
-            continue
 
-        # Double check file type
-        mime_type = mime.from_file(f'{drive_info.local_download_folder}/{image_hash}')
-        if mime_type != "image/jpeg":
-            os.remove(f'{drive_info.local_download_folder}/{image_hash}')
-            logger.error(f'Skipped image: {image_hash} with MimeType: {mime_type}')
-            r.hset(drive_info.redis_skipped_images, image_hash, mime_type)
-            continue
-
-        # Resize our image to smaller than 1024x1024
-        try:
-            # Load image
-            img = Image.open(f'{drive_info.local_download_folder}/{image_hash}')
-            # Delete the file
-            os.remove(f'{drive_info.local_download_folder}/{image_hash}')
-            # Resize it
-            img.thumbnail(size=drive_info.max_image_size)
-            # Save it
-            img.save(f'{drive_info.local_download_folder}/{image_hash}.jpg', "JPEG")
-        except OSError:
-            logger.error(f"Unable to resize image: {image_hash}")
-            r.hset(drive_info.redis_skipped_images, image_hash, 'OSError')
-            continue
-
-        # Update redis
-        r.sadd(drive_info.redis_downloaded_images, image_hash)
-
-        if img_num % 20 == 0:
-            # Logging / stats
-            logger.info(f"{img_num} images downloaded...")
+@app.post('/find_faces/')
+async def find_face_encodings(process_images_info: ProcessImagesInfo):
+    job_id = jobs.submit('find_faces', process_images_info.dict())
+    return {'message': 'indexing faces...', 'job_id': job_id}
 
 
 #################################
-#        Process Images         #
+#         Cluster Faces         #
 #################################
 
 
-# class ProcessImagesInfo(BaseModel):
-#     local_download_folder: str
-#     redis_downloaded_images: Optional[str] = f"downloaded_images_{version}"
-#     redis_processed_images: Optional[str] = f"processed_images_{version}"
-#     redis_all_face_encodings: Optional[str] = f"all_face_encodings_{version}"
-#
-#
-# @app.post('/find_faces/')
-# async def find_face_encodings(process_images_info: ProcessImagesInfo, background_tasks: BackgroundTasks):
-#     background_tasks.add_task(find_face_encodings_process, process_images_info)
-#     return {'message': 'indexing faces...'}
-#
-#
-# def find_face_encodings_process(process_images_info: ProcessImagesInfo):
-#     """
-#     Process downloaded photos and find faces / encodings
-#     """
-#     # Load all our images
-#     images = r.smembers(process_images_info.redis_downloaded_images)
-#     all_images = len(images)
-#     logger.debug(f'{all_images} images sent for processing....')
-#
-#     # Remove processed images
-#     [images.remove(processed_images) for processed_images in r.smembers(process_images_info.redis_processed_images)]
-#     logger.debug(f'Skipping: {all_images - len(images)} (already processed)....')
-#
-#     # Decode images
-#     images = [k.decode('utf-8') for k in images]
-#
-#     for img_num, image_hash in enumerate(images, start=1):
-#
-#         # Load up our image
-#         image_path = f'{process_images_info.local_download_folder}/{image_hash}.jpg'
-#
-#         with open(image_path, 'rb') as img:
-#             image = img.read()
-#
-#         payload = {"images": {"data": [b64encode(image).decode('utf-8')]}}
-#
-#         # Analyze our image / send it to insightface
-#         try:
-#             req = requests.post(url='http://10.0.42.70:31428/extract', data=json.dumps(payload))
-#
-#             faces = json.loads(req.text)[0]
-#             logger.debug(f'Found {len(faces)} in {image_hash}')
-#
-#             # Loop through found faces
-#             for face in faces:
-#
-#                 face_info = {
-#                     'img_hash': image_hash,
-#                     'encoding': face['vec'],
-#                     'box': face['bbox']
-#                 }
-#
-#                 r.sadd(process_images_info.redis_all_face_encodings, pickle.dumps(face_info))
-#
-#             r.sadd(process_images_info.redis_processed_images, image_hash)
-#
-#         except Exception as e:
-#             logger.error(f"Unable to analyze image: {e}")
-#
-#         if img_num % 100 == 0:
-#             # Logging / stats
-#             logger.debug(f"{img_num} images processed...")
+@app.post('/cluster_faces/')
+async def cluster_faces(cluster_info: ClusterFacesInfo = ClusterFacesInfo()):
+    job_id = jobs.submit('cluster_faces', cluster_info.dict())
+    return {'message': f'clustering faces ({cluster_info.method})...', 'job_id': job_id}
 
 
 #################################
@@ -441,57 +270,90 @@ class PredictImagesInfo(BaseModel):
     redis_known_encodings: Optional[str] = f"known_encodings_{version}"
 
 
-@logger.catch
-@app.post('/predict_label_image/')
-async def predict_label_images(response: Response, predict_images_info: PredictImagesInfo = PredictImagesInfo(), image: UploadFile = File(...)):
+async def predict(gallery, data: bytes, render: bool = False):
+    """
+    Find and identify every face in one upload
+
+    Reposts of the same photo are one hash and one matrix multiply: the
+    cached entry has everything but the pixels, so the upload is only
+    decoded on a hit when render asks for them
 
-    # Create an image to draw on
-    overlay_image = Image.open(image.file).convert('RGB')  # Open and drop alpha channel
-    draw = ImageDraw.Draw(overlay_image)
+    return: extractor image size, prepared image (None on a hit without render), faces, guesses per face
+    """
+    img_hash = f"{image_hash(data)}_{PREDICT_MAX_IMAGE_SIZE}"
+    cached = face_cache.get(gallery.matcher.fingerprint, img_hash) if PREDICT_CACHE_BACKEND != 'off' else None
 
-    # try:
-    img_jpg = BytesIO()
-    overlay_image.save(img_jpg, format="JPEG")
+    prepared = None
+    if cached is None or render:
+        # Forward the upload as-is when we can, otherwise decode / shrink it once
+        prepared = await run_in_threadpool(prepare_image, data)
 
-    # payload = {"images": {"data": [b64encode(image.file.read()).decode('utf-8')]}}
-    payload = {"images": {"data": [b64encode(img_jpg.getvalue()).decode('utf-8')]}}
+    if cached is None:
+        faces = await batcher.extract(prepared.payload)  # Concurrent calls share extractor batches
+        size = prepared.size
 
-    req = requests.post(url='http://10.0.42.70:31428/extract', data=json.dumps(payload))
+        if PREDICT_CACHE_BACKEND != 'off':
+            face_cache.set(gallery.matcher.fingerprint, img_hash, faces, size)
+    else:
+        faces, size = cached['faces'], tuple(cached['size'])
 
-    faces = json.loads(req.text)[0]
-    logger.debug(f"response: {req.text}")
     logger.debug(f"found: {len(faces)} faces...")
 
-    # Loop through faces
-    accuracy_scores = {}
-    for face in faces:
-        left, top, right, bottom = face['bbox']
-        face_encoding = face['vec']
+    # Match every face against the known face(s) at once
+    all_guesses = gallery.matcher.match([face['vec'] for face in faces])
+
+    return size, prepared, faces, all_guesses
+
+
+def accuracy_scores(all_guesses):
+    return {guesses[0][0]: guesses for guesses in all_guesses}  # First guess, profile name
+
+
+def face_results(faces, all_guesses):
+    """
+    Structured results: box (extractor image coordinates) and top guesses per face
+    """
+    return [{'bbox': face['bbox'], 'guesses': guesses} for face, guesses in zip(faces, all_guesses)]
+
 
-        # See if the face is a match for the known face(s)
-        guesses = find_closest_match(profiles, face_encoding)
-        profile_name = guesses[0][0]  # First guess, profile name
-        accuracy_scores[profile_name] = guesses
+def check_format(format: str):
+    if format not in PREDICT_FORMATS:
+        raise HTTPException(status_code=422, detail=f"format must be one of: {', '.join(PREDICT_FORMATS)}")
 
-        # Draw a box around the face using the Pillow module
-        draw.rectangle(((left, top), (right, bottom)), outline=(0, 0, 255))
 
-        # Draw a label with a name below the face
-        text_width, text_height = draw.textsize(profile_name)
-        draw.rectangle(((left, bottom - text_height - 10), (right, bottom)), fill=(0, 0, 255), outline=(0, 0, 255))
-        draw.text((left + 6, bottom - text_height - 5), profile_name, fill=(255, 255, 255, 255))
+# jpeg: annotated image (scores in headers), json: results only, svg: results + overlay to draw client-side
+PREDICT_FORMATS = ('jpeg', 'json', 'svg')
 
-    del draw
 
-    # Save it into a bytes stream
-    output_image_stream = BytesIO()
-    overlay_image.save(output_image_stream, format='JPEG')
-    output_image_stream.seek(0)
+@logger.catch
+@app.post('/predict_label_image/')
+async def predict_label_images(response: Response, predict_images_info: PredictImagesInfo = PredictImagesInfo(), image: UploadFile = File(...), format: str = 'jpeg'):
+
+    check_format(format)
+    data = await image.read()
+    gallery = await galleries.get()
+
+    try:
+        size, prepared, faces, all_guesses = await predict(gallery, data, render=format == 'jpeg')
+    except ExtractorError as e:
+        logger.error(f"Unable to analyze image: {e}")
+        raise HTTPException(status_code=502, detail=str(e))
+
+    # Callers that only need IDs skip rendering (and the score headers, which overflow on group photos)
+    if format != 'jpeg':
+        results = {'gallery_version': gallery.version, 'size': size, 'faces': face_results(faces, all_guesses)}
+        if format == 'svg':
+            results['svg'] = svg_overlay(size, faces, [guesses[0][0] for guesses in all_guesses])
+        return results
+
+    # Draw boxes and labels on the (single) decoded copy
+    output_image_stream = BytesIO(await run_in_threadpool(annotate, prepared.decode(), faces, [guesses[0][0] for guesses in all_guesses]))
 
     # return {'image': output_image_stream.getvalue(), 'accuracy_scores': accuracy_scores}
     response = StreamingResponse(output_image_stream)
 
-    response.headers['X-accuracy_scores'] = json.dumps(accuracy_scores)
+    response.headers['X-accuracy_scores'] = json.dumps(accuracy_scores(all_guesses))
+    response.headers['X-gallery_version'] = gallery.version
 
     return response
 
@@ -499,77 +361,74 @@ async def predict_label_images(response: Response, predict_images_info: PredictI
     #     logger.error(f"Unable to analyze image: {e}")
 
 
-#################################
-#         Find Person           #
-#################################
+@app.post('/predict_label_images/')
+async def predict_label_images_batch(images: List[UploadFile] = File(...), format: str = 'jpeg'):
+    """
+    Label many uploads in one request
 
+    Every image goes through the pipeline concurrently, so the extractor
+    gets them in full batches; one NDJSON line per image is streamed back
+    as soon as that image is done (in completion order, see "index")
+    """
+    check_format(format)
+    gallery = await galleries.get()  # One snapshot for the whole request
+    uploads = [(index, upload.filename, await upload.read()) for index, upload in enumerate(images)]
+
+    async def label(index, filename, data):
+        result = {'index': index, 'filename': filename, 'gallery_version': gallery.version}
+        try:
+            size, prepared, faces, all_guesses = await predict(gallery, data, render=format == 'jpeg')
+            labels = [guesses[0][0] for guesses in all_guesses]
+
+            result['size'] = size
+            result['faces'] = face_results(faces, all_guesses)
+            if format == 'jpeg':
+                result['image'] = b64encode(await run_in_threadpool(annotate, prepared.decode(), faces, labels)).decode('ascii')
+            elif format == 'svg':
+                result['svg'] = svg_overlay(size, faces, labels)
+        except Exception as e:
+            logger.error(f"Unable to analyze image {filename}: {e}")
+            result['error'] = str(e)
+        return result
 
-class FindPerson(BaseModel):
-    search_string: str
-    rclone_drive: str
-    path: str
-    output_dir: str
+    async def results():
+        for finished in asyncio.as_completed([label(*upload) for upload in uploads]):
+            yield json.dumps(await finished) + '\n'
 
-    # redis_images_index: Optional[str] = f"images_index_{version}"
-    # redis_faces_to_images: Optional[str] = f"faces_to_images_{version}"
-    redis_images_index: Optional[str] = f"images_index_{version}"
-    redis_faces_to_images: Optional[str] = f"faces_to_images"
+    return StreamingResponse(results(), media_type='application/x-ndjson')
 
-    @validator('path')
-    def no_leading_trailing_slash(cls, v):
-        return v.strip('/')
+
+#################################
+#         Find Person           #
+#################################
 
 
 @app.post('/find_person/')
-async def find_person(find_person_info: FindPerson, background_tasks: BackgroundTasks):
+async def find_person(find_person_info: FindPerson):
+
+    gallery = await galleries.get()
 
-    # Find closest match
-    closest_match = find_person_info.search_string if find_person_info.search_string in all_profiles else fz_process.extractOne(find_person_info.search_string, all_profiles.keys())[0]
+    # Find closest matches through the name index (exact and CamelCase matches score 100)
+    candidates = gallery.names.search(find_person_info.search_string, limit=find_person_info.max_candidates)
+    if not candidates:
+        raise HTTPException(status_code=404, detail=f"No profile matches: {find_person_info.search_string}")
+    closest_match = candidates[0][0]
 
-    # Start upload
-    background_tasks.add_task(find_person_process, find_person_info, all_profiles, images_index, closest_match)
+    # Start upload on a worker; progress is visible at /jobs/{job_id}
+    job_id = jobs.submit('find_person', {'find_person_info': find_person_info.dict(), 'closest_match': closest_match}, profile_name=closest_match)
 
     # Return
-    return {'message': f'uploading photos...', 'profile_name': closest_match}
+    return {'message': f'uploading photos...', 'profile_name': closest_match, 'candidates': candidates, 'job_id': job_id, 'gallery_version': gallery.version}
 
 
-async def find_person_process(find_person_info: FindPerson, all_profiles, images_index, closest_match):
-    """
-    Find all images of a specific person
-    """
+#################################
+#             Jobs              #
+#################################
 
-    # Asynchronously run rclone
-    async def run(cmd):
-        logger.debug(f'Running: {cmd}')
-        proc = await asyncio.create_subprocess_shell(
-            cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-
-        stdout, stderr = await proc.communicate()
-
-        logger.debug(f'[{cmd!r} exited with {proc.returncode}]')
-        if stdout:
-            logger.debug(f'[stdout]\n{stdout.decode()}')
-        if stderr:
-            logger.debug(f'[stderr]\n{stderr.decode()}')
-
-    subprocess.run(['rclone', 'mkdir', fr'{find_person_info.rclone_drive}:/{find_person_info.output_dir}/{closest_match}'])
-
-    # Create a list of commands we need to run
-    copy_commands = []
-    for photo in json.loads(all_profiles[closest_match]):
-        photo_path = images_index[photo]
-        photo_name = photo_path.rsplit('/', maxsplit=1)[-1]
-        logger.debug(f"Added {photo_name}")
-        copy_commands.append(
-            'rclone copyto '
-            fr'"{find_person_info.rclone_drive}:/{find_person_info.path}/{photo_path}" '  # Source
-            fr'"{find_person_info.rclone_drive}:/{find_person_info.output_dir}/{closest_match}/{photo_name}"'  # Destination
-        )
-
-    await asyncio.gather(*[run(cmd) for cmd in copy_commands])
-
-    logger.debug(f"Done finding {closest_match}!")
 
+@app.get('/jobs/{job_id}')
+async def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
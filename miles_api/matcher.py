@@ -0,0 +1,323 @@
+import time
+import uuid
+import pickle
+import hashlib
+import numpy as np
+
+from loguru import logger
+from sklearn.cluster import MiniBatchKMeans
+
+from miles_api.resources.default_configs import (
+    MATCHER_INDEX,
+    MATCHER_EXACT_MAX_PROFILES,
+    MATCHER_IVF_LISTS,
+    MATCHER_IVF_NPROBE,
+    MATCHER_IVF_BUILD_TIMEOUT,
+    MATCHER_IVF_WAIT
+)
+
+
+def normalize_rows(matrix):
+    """
+    L2-normalize every row of a matrix (zero rows are left as zeros)
+    """
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def top_k(sims, k):
+    """
+    Indices and values of the k largest similarities, best first
+    """
+    k = min(k, len(sims))
+    if k == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=sims.dtype)
+
+    # Partial selection of the top k, then sort just those k
+    top = np.argpartition(-sims, k - 1)[:k]
+    top = top[np.argsort(-sims[top])]
+    return top, sims[top]
+
+
+class Embeddings:
+    """
+    Normalized profile rows stored as float32, float16 or int8 (with per-row scales)
+
+    Rows may live in a read-only memmap; they are dequantized a chunk
+    at a time while scoring, never all at once
+    """
+
+    def __init__(self, matrix, scales=None, chunk_size=65536):
+        self.matrix = matrix
+        self.scales = scales
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return len(self.matrix)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    def dense(self, rows=None):
+        """
+        float32 copy of the given rows (all rows when None)
+        """
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        dense = np.asarray(matrix, dtype=np.float32)
+        if self.scales is not None:
+            dense = dense * (self.scales if rows is None else self.scales[rows])[:, None]
+        return dense
+
+    def scores(self, faces, rows=None):
+        """
+        Cosine similarity of normalized faces to the given rows: (faces, rows)
+        """
+        if rows is not None:
+            return faces @ self.dense(rows).T
+
+        if self.matrix.dtype == np.float32:
+            return faces @ self.matrix.T
+
+        return np.concatenate([
+            faces @ self.dense(np.arange(start, min(start + self.chunk_size, len(self)))).T
+            for start in range(0, len(self), self.chunk_size)
+        ], axis=1)
+
+
+#################################
+#           Indexes             #
+#################################
+
+
+class ExactIndex:
+    """
+    Brute-force scan over every profile
+    """
+    kind = 'exact'
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def search(self, faces, k):
+        sims = self.embeddings.scores(faces)
+        return [top_k(face_sims, k) for face_sims in sims]
+
+
+class IVFIndex:
+    """
+    Inverted file index: profiles are bucketed under k-means centroids and
+    only the nprobe closest buckets are scanned per face
+    """
+    kind = 'ivf'
+
+    def __init__(self, embeddings, centroids, order, offsets, fingerprint, nprobe=MATCHER_IVF_NPROBE):
+        self.embeddings = embeddings
+        self.centroids = centroids
+        self.order = order  # Profile rows grouped by bucket
+        self.offsets = offsets  # Bucket i is order[offsets[i]:offsets[i + 1]]
+        self.fingerprint = fingerprint
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, embeddings, fingerprint, n_lists=MATCHER_IVF_LISTS, nprobe=MATCHER_IVF_NPROBE, max_train_size=100000):
+        n_lists = n_lists or max(1, int(4 * np.sqrt(len(embeddings))))
+        n_lists = min(n_lists, len(embeddings))
+        logger.debug(f"Training IVF index: {len(embeddings)} profiles into {n_lists} lists....")
+
+        # Train centroids on a sample so memory stays bounded for huge galleries
+        sample = np.arange(len(embeddings))
+        if len(sample) > max_train_size:
+            sample = np.sort(np.random.default_rng(0).choice(sample, max_train_size, replace=False))
+
+        # Random init: k-means++ seeding alone takes most of the training time with hundreds of lists,
+        # and coarse IVF buckets don't need it
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, init='random', batch_size=4096, n_init=1, max_iter=20, random_state=0).fit(embeddings.dense(sample))
+        centroids = np.ascontiguousarray(normalize_rows(kmeans.cluster_centers_.astype(np.float32)))
+
+        # Assign by cosine similarity (same metric we search with), in chunks to bound memory
+        assignments = np.concatenate([
+            np.argmax(centroids @ embeddings.dense(np.arange(start, min(start + embeddings.chunk_size, len(embeddings)))).T, axis=0)
+            for start in range(0, len(embeddings), embeddings.chunk_size)
+        ])
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.searchsorted(assignments[order], np.arange(n_lists + 1))
+
+        return cls(embeddings, centroids, order, offsets, fingerprint, nprobe)
+
+    def dumps(self):
+        return pickle.dumps({
+            'kind': self.kind,
+            'fingerprint': self.fingerprint,
+            'centroids': self.centroids,
+            'order': self.order,
+            'offsets': self.offsets,
+        })
+
+    @classmethod
+    def loads(cls, blob, embeddings, nprobe=MATCHER_IVF_NPROBE):
+        data = pickle.loads(blob)
+        return cls(embeddings, data['centroids'], data['order'], data['offsets'], data['fingerprint'], nprobe)
+
+    def search(self, faces, k):
+        if not len(faces):
+            return []
+
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(faces @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        # Scan list by list rather than face by face: each probed list is dequantized
+        # once and scored against every face probing it with a single matrix multiply
+        best_rows = np.full((len(faces), k), -1, dtype=np.int64)
+        best_sims = np.full((len(faces), k), -np.inf, dtype=np.float32)
+
+        lists, face_ids = probes.ravel(), np.repeat(np.arange(len(faces)), nprobe)
+        by_list = np.argsort(lists, kind='stable')
+        lists, face_ids = lists[by_list], face_ids[by_list]
+        bounds = np.flatnonzero(np.diff(lists)) + 1
+
+        for group_lists, group_faces in zip(np.split(lists, bounds), np.split(face_ids, bounds)):
+            bucket = group_lists[0]
+            rows = self.order[self.offsets[bucket]:self.offsets[bucket + 1]]
+            if not len(rows):
+                continue
+
+            # Merge this list's candidates into each face's running top k
+            sims = np.concatenate([best_sims[group_faces], self.embeddings.scores(faces[group_faces], rows)], axis=1)
+            candidates = np.concatenate([best_rows[group_faces], np.broadcast_to(rows, (len(group_faces), len(rows)))], axis=1)
+            keep = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            best_sims[group_faces] = np.take_along_axis(sims, keep, axis=1)
+            best_rows[group_faces] = np.take_along_axis(candidates, keep, axis=1)
+
+        results = []
+        for rows, sims in zip(best_rows, best_sims):
+            found = rows >= 0
+            rows, sims = rows[found], sims[found]
+            ranked = np.argsort(-sims, kind='stable')
+            results.append((rows[ranked], sims[ranked]))
+
+        return results
+
+
+#################################
+#           Matcher             #
+#################################
+
+
+class FaceMatcher:
+    """
+    Matches face encodings against every known profile at once
+
+    Profile encodings are normalized a single time into a contiguous
+    matrix, searched exactly or through an IVF index for large galleries
+    """
+
+    def __init__(self, names, embeddings: Embeddings, fingerprint):
+        self.names = names
+        self.embeddings = embeddings
+        self.fingerprint = fingerprint
+        self.index = ExactIndex(self.embeddings)
+
+        logger.debug(f"Matcher built: {len(embeddings)} profiles x {embeddings.dim} dims ({embeddings.matrix.dtype})")
+
+    @classmethod
+    def from_profiles(cls, profiles: dict):
+        """
+        Build from a {name: encoding} dict, as pickled in known_encodings
+        """
+        matrix = np.asarray(list(profiles.values()), dtype=np.float32).reshape(len(profiles), -1)
+        matrix = np.ascontiguousarray(normalize_rows(matrix))
+        return cls(list(profiles), Embeddings(matrix), hashlib.md5(matrix.data).hexdigest())
+
+    @classmethod
+    def from_store(cls, store):
+        """
+        Build on top of a memory-mapped EmbeddingStore without copying it
+        """
+        return cls(store.names, Embeddings(store.matrix, store.scales), store.fingerprint)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _load_index(self, r, redis_index_key):
+        """
+        return: the IVF index persisted at redis_index_key if it was built for this gallery, else None
+        """
+        blob = r.get(redis_index_key)
+        if blob is None:
+            return None
+        index = IVFIndex.loads(blob, self.embeddings)
+        return index if index.fingerprint == self.fingerprint else None
+
+    def attach_index(self, r, redis_index_key, kind=MATCHER_INDEX, wait=MATCHER_IVF_WAIT):
+        """
+        Pick the search backend, loading a persisted IVF index from Redis
+        when it matches this gallery, or training and persisting a new one
+
+        Only the worker holding {redis_index_key}:lock trains; the others
+        wait up to wait seconds for its index, then search exactly
+        """
+        if kind == 'exact' or (kind == 'auto' and len(self) <= MATCHER_EXACT_MAX_PROFILES):
+            self.index = ExactIndex(self.embeddings)
+            logger.debug(f"Using exact search over {len(self)} profiles")
+            return
+
+        lock_key, token = f"{redis_index_key}:lock", uuid.uuid4().hex
+        deadline = time.monotonic() + wait
+        while True:
+            index = self._load_index(r, redis_index_key)
+            if index is not None:
+                self.index = index
+                logger.debug(f"Loaded IVF index from {redis_index_key} (nprobe={index.nprobe})")
+                return
+
+            if r.set(lock_key, token, nx=True, ex=MATCHER_IVF_BUILD_TIMEOUT):
+                break
+
+            if time.monotonic() >= deadline:
+                self.index = ExactIndex(self.embeddings)
+                logger.warning(f"IVF index at {redis_index_key} is still being trained elsewhere, using exact search")
+                return
+            time.sleep(0.5)
+
+        try:
+            logger.debug(f"No IVF index for this gallery at {redis_index_key}, training....")
+            self.index = IVFIndex.build(self.embeddings, self.fingerprint)
+            r.set(redis_index_key, self.index.dumps())
+            logger.debug(f"Saved IVF index to {redis_index_key}")
+        finally:
+            if r.get(lock_key) == token.encode('ascii'):
+                r.delete(lock_key)
+
+    def assign(self, encodings, min_similarity: float):
+        """
+        Best profile for each encoding, for labelling faces without a human looking
+
+        return: profile index per encoding, -1 when the best cosine similarity is below min_similarity
+        """
+        labels = np.full(len(encodings), -1, dtype=np.int32)
+        if not len(encodings):
+            return labels
+
+        faces = normalize_rows(np.asarray(encodings, dtype=np.float32).reshape(len(encodings), -1))
+        for i, (matches, sims) in enumerate(self.index.search(faces, 1)):
+            if len(matches) and sims[0] >= min_similarity:
+                labels[i] = matches[0]
+        return labels
+
+    def match(self, encodings, k=3):
+        """
+        Find the k closest profiles for each encoding
+
+        return: [[[profile, score], ...], ...] one list per encoding, best match first
+        """
+        if not len(encodings):
+            return []
+
+        faces = normalize_rows(np.asarray(encodings, dtype=np.float32).reshape(len(encodings), -1))
+
+        return [
+            [[self.names[match], round(100 * (1. + float(sim)) / 2, 2)] for match, sim in zip(matches, sims)]
+            for matches, sims in self.index.search(faces, k)
+        ]
@@ -0,0 +1,86 @@
+import re
+
+from collections import Counter, defaultdict
+from fuzzywuzzy import fuzz
+
+# Runs of letters (any script) or of digits; name_parts then splits the letters on case changes
+NAME_WORDS = re.compile(r'[^\W\d_]+|\d+')
+
+
+def name_parts(name: str):
+    """
+    Split CamelCase profile names ('CorbinVia' -> 'Corbin', 'Via'), keeping acronyms and digits together
+
+    Works on any alphabet: 'JoséÁlvarez' -> 'José', 'Álvarez', and
+    scripts without case ('王小明') stay one part
+    """
+    parts = []
+    for word in NAME_WORDS.findall(name):
+        start = 0
+        for i in range(1, len(word)):
+            # aB -> a|B, and ABc -> A|Bc (end of an acronym)
+            if word[i].isupper() and (word[i - 1].islower() or (word[i - 1].isupper() and i + 1 < len(word) and word[i + 1].islower())):
+                parts.append(word[start:i])
+                start = i
+        parts.append(word[start:])
+    return parts
+
+
+def normalize_name(name: str):
+    """
+    'CorbinVia', 'corbin via' and 'Corbin  Via!' all become 'corbin via'
+    """
+    return ' '.join(part.lower() for part in name_parts(name))
+
+
+def trigrams(text: str):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """
+    Fuzzy profile name lookup that doesn't scan every name
+
+    A trigram inverted index picks the few names sharing the most
+    trigrams with the query; only those get the (slow) fuzzy score
+    """
+
+    def __init__(self, names, candidates: int = 50):
+        self.names = list(names)
+        self.candidates = candidates
+        self.normalized = [normalize_name(name) for name in self.names]
+        self.exact = {}
+        self.postings = defaultdict(list)
+
+        for i, normalized in enumerate(self.normalized):
+            if not normalized:
+                continue  # Nothing left to look it up by (e.g. all punctuation)
+            self.exact.setdefault(normalized, i)
+            self.exact.setdefault(normalized.replace(' ', ''), i)
+            for gram in trigrams(normalized):
+                self.postings[gram].append(i)
+
+    def __len__(self):
+        return len(self.names)
+
+    def search(self, query: str, limit: int = 5):
+        """
+        Best matching profile names
+
+        return: [[name, score 0-100], ...] best first
+        """
+        query = normalize_name(query)
+
+        overlap = Counter()
+        for gram in trigrams(query):
+            overlap.update(self.postings.get(gram, ()))
+
+        scored = {i: fuzz.WRatio(query, self.normalized[i]) for i, _ in overlap.most_common(self.candidates)}
+
+        exact = self.exact.get(query, self.exact.get(query.replace(' ', '')))
+        if exact is not None:
+            scored[exact] = 100
+
+        best = sorted(scored.items(), key=lambda item: (-item[1], self.names[item[0]]))[:limit]
+        return [[self.names[i], score] for i, score in best]
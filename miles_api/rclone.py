@@ -0,0 +1,139 @@
+import os
+import re
+import json
+import asyncio
+import tempfile
+import subprocess
+
+from loguru import logger
+from typing import List, Tuple
+
+
+# Drive / HTTP throttling as rclone reports it, e.g. "googleapi: Error 403: User Rate Limit Exceeded. ..., userRateLimitExceeded"
+# or "Error 429: Too Many Requests". Bare status codes aren't enough: they show up in file names
+RATE_LIMITED = re.compile(r'\b(?:user)?RateLimitExceeded\b|\bError 429\b|\bError 403:[^\n]*Rate ?Limit', re.IGNORECASE)
+
+
+class RcloneError(Exception):
+    pass
+
+
+def iter_lsjson(remote: str, *args):
+    """
+    Stream `rclone lsjson` entries as rclone prints them
+
+    rclone writes the JSON array one object per line ("[", "{...},", ..., "]"),
+    so each line is parsed on its own and nothing holds the whole listing
+    """
+    cmd = ['rclone', 'lsjson', remote, *args]
+    logger.debug(f"Running: {' '.join(cmd)}")
+
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True, encoding='utf-8') as proc:
+        for line in proc.stdout:
+            line = line.strip().rstrip(',')
+            if line in ('', '[', ']'):
+                continue
+            yield json.loads(line)
+
+    if proc.returncode != 0:
+        raise RcloneError(f"{' '.join(cmd)} exited with {proc.returncode}")
+
+
+def copy_files_from(source: str, destination: str, paths: List[str], transfers: int = 8, checkers: int = 16):
+    """
+    Copy many files with a single `rclone copy --files-from-raw` process
+
+    paths are relative to source and keep their relative path under destination
+
+    return: {path: error message or None}
+    """
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.txt', delete=False) as manifest:
+        manifest.write('\n'.join(paths) + '\n')
+
+    cmd = [
+        'rclone', 'copy', source, destination,
+        '--files-from-raw', manifest.name,
+        '--no-traverse',  # Don't list the (possibly huge) destination
+        '--transfers', str(transfers),
+        '--checkers', str(checkers),
+        '--use-json-log', '--log-level', 'INFO'
+    ]
+    logger.debug(f"Copying {len(paths)} files: {source} -> {destination}")
+
+    try:
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, encoding='utf-8')
+    finally:
+        os.remove(manifest.name)
+
+    # rclone logs one JSON object per line; failed files carry their path in "object"
+    errors = {}
+    for line in proc.stderr.splitlines():
+        try:
+            log = json.loads(line)
+        except ValueError:
+            continue
+        if log.get('level') == 'error' and log.get('object'):
+            errors[log['object']] = log.get('msg', 'error')
+
+    results = {path: errors.get(path) for path in paths}
+
+    # Local destinations let us confirm every file actually landed
+    if os.path.isdir(destination):
+        for path in paths:
+            if results[path] is None and not os.path.exists(os.path.join(destination, path)):
+                results[path] = f"not copied (rclone exited with {proc.returncode})"
+
+    return results
+
+
+async def copyfile_batch(copies: List[Tuple[str, str, str, str]], concurrency: int = 8):
+    """
+    Run many server-side `operations/copyfile` calls in one rclone process (rclone >= 1.64)
+
+    copies: (source fs, source path, destination fs, destination path),
+    so files can be renamed / flattened on the way
+
+    return: one error message or None per copy
+    """
+    inputs = [
+        {'_path': 'operations/copyfile', 'srcFs': src_fs, 'srcRemote': src_remote, 'dstFs': dst_fs, 'dstRemote': dst_remote}
+        for src_fs, src_remote, dst_fs, dst_remote in copies
+    ]
+
+    proc = await asyncio.create_subprocess_exec(
+        'rclone', 'rc', '--loopback', 'job/batch', '--json', json.dumps({'concurrency': concurrency, 'inputs': inputs}),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await proc.communicate()
+
+    try:
+        results = json.loads(stdout).get('results', [])
+    except ValueError:
+        results = []
+
+    if len(results) != len(copies):
+        error = stderr.decode(errors='replace').strip() or f"rclone exited with {proc.returncode}"
+        return [error] * len(copies)
+
+    return [result.get('error') if isinstance(result, dict) else None for result in results]
+
+
+async def list_file_names(remote: str):
+    """
+    Names of the files directly inside remote (empty if it doesn't exist yet)
+    """
+    proc = await asyncio.create_subprocess_exec(
+        'rclone', 'lsf', remote, '--files-only',
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    stdout, _ = await proc.communicate()
+    return set(stdout.decode('utf-8').splitlines()) if proc.returncode == 0 else set()
+
+
+def is_rate_limited(error: str):
+    """
+    Whether an rclone error is Drive / HTTP throttling, worth retrying after a pause
+    """
+    return RATE_LIMITED.search(error) is not None
@@ -0,0 +1,47 @@
+from os import environ
+
+REDIS_HOST = environ.get("REDIS_HOST")
+
+# Suffix of the versioned Redis keys (images_index_{version}, downloaded_images_{version}, ...)
+VERSION = environ.get("version") or "10"
+
+# Matcher index: "exact", "ivf" or "auto" (exact below MATCHER_EXACT_MAX_PROFILES)
+MATCHER_INDEX = environ.get("MATCHER_INDEX") or "auto"
+MATCHER_EXACT_MAX_PROFILES = int(environ.get("MATCHER_EXACT_MAX_PROFILES") or 20000)
+MATCHER_IVF_LISTS = int(environ.get("MATCHER_IVF_LISTS") or 0)  # 0 picks ~4 * sqrt(profiles)
+MATCHER_IVF_NPROBE = int(environ.get("MATCHER_IVF_NPROBE") or 16)  # Higher = better recall, slower
+MATCHER_IVF_BUILD_TIMEOUT = int(environ.get("MATCHER_IVF_BUILD_TIMEOUT") or 600)  # Seconds before a training lock is considered dead
+MATCHER_IVF_WAIT = float(environ.get("MATCHER_IVF_WAIT") or 30)  # Seconds to wait on another worker's training before searching exactly
+
+# Compact, memory-mapped copies of known_encodings (one file per gallery version) shared by all workers
+EMBEDDING_STORE_DIR = environ.get("EMBEDDING_STORE_DIR") or "/tmp/miles"
+EMBEDDING_STORE_DTYPE = environ.get("EMBEDDING_STORE_DTYPE") or "float16"  # float32, float16 or int8
+
+# insightface extractor
+EXTRACTOR_URL = environ.get("EXTRACTOR_URL") or "http://10.0.42.70:31428/extract"
+EXTRACTOR_MULTIPART_URL = environ.get("EXTRACTOR_MULTIPART_URL")  # Set if the extractor accepts multipart JPEG uploads
+EXTRACTOR_TIMEOUT = float(environ.get("EXTRACTOR_TIMEOUT") or 30)  # Seconds
+EXTRACTOR_RETRIES = int(environ.get("EXTRACTOR_RETRIES") or 3)
+EXTRACTOR_BACKOFF = float(environ.get("EXTRACTOR_BACKOFF") or 0.5)  # Seconds, doubled every retry
+EXTRACTOR_MAX_CONCURRENCY = int(environ.get("EXTRACTOR_MAX_CONCURRENCY") or 8)
+EXTRACTOR_MAX_BATCH = int(environ.get("EXTRACTOR_MAX_BATCH") or 16)  # Images per /extract call
+EXTRACTOR_MAX_WAIT_MS = float(environ.get("EXTRACTOR_MAX_WAIT_MS") or 5)  # How long a request waits for batch-mates
+
+# Uploads larger than this (px, longest side) are decoded at reduced size before extraction
+PREDICT_MAX_IMAGE_SIZE = int(environ.get("PREDICT_MAX_IMAGE_SIZE") or 2048)
+
+# Cache of extractor results keyed by upload hash: "memory" (per worker), "redis" (shared) or "off"
+PREDICT_CACHE_BACKEND = environ.get("PREDICT_CACHE_BACKEND") or "memory"
+PREDICT_CACHE_SIZE = int(environ.get("PREDICT_CACHE_SIZE") or 1024)  # Images, in-process only
+PREDICT_CACHE_TTL = int(environ.get("PREDICT_CACHE_TTL") or 86400)  # Seconds
+
+# Bump this key in Redis (see gallery.bump_gallery_version) to hot-reload every API worker
+GALLERY_VERSION_KEY = environ.get("GALLERY_VERSION_KEY") or "gallery_version"
+GALLERY_POLL_INTERVAL = float(environ.get("GALLERY_POLL_INTERVAL") or 30)  # Seconds
+
+# Long-running jobs (indexing, downloads, find_person) run in miles_api.worker processes
+JOBS_PREFIX = environ.get("JOBS_PREFIX") or "jobs"
+JOBS_TTL = int(environ.get("JOBS_TTL") or 7 * 24 * 3600)  # Seconds finished jobs stay visible
+JOBS_MAX_ATTEMPTS = int(environ.get("JOBS_MAX_ATTEMPTS") or 3)  # Runs interrupted by a dead worker before a job is marked failed
+WORKER_NAME = environ.get("WORKER_NAME")  # Defaults to the hostname
+WORKER_HEARTBEAT_TTL = int(environ.get("WORKER_HEARTBEAT_TTL") or 60)  # Seconds before a silent worker's jobs are requeued
@@ -0,0 +1,453 @@
+import os
+import time
+import asyncio
+import subprocess
+
+from loguru import logger
+from pydantic import BaseModel, validator
+from typing import Optional
+
+from miles_api.redis import r
+from miles_api.jobs import Job
+from miles_api.rclone import iter_lsjson, copyfile_batch, list_file_names, is_rate_limited
+from miles_api.downloads import download_images
+from miles_api.drive_index import sync_images_index
+from miles_api.extraction import extract_faces, FaceLabeller
+from miles_api.clustering import cluster_faces, import_legacy_face_encodings
+from miles_api.face_table import FaceTable
+from miles_api.embedding_store import set_profiles
+from miles_api.gallery import bump_gallery_version
+from miles_api.face_maps import iter_person_images
+from miles_api.resources.default_configs import VERSION as version
+
+
+#################################
+#         Images Index          #
+#################################
+
+
+class IndexDriveInfo(BaseModel):
+    rclone_drive: str
+    path: str
+    redis_images_index: Optional[str] = f"images_index_{version}"
+    redis_chunk_size: Optional[int] = 5000  # Images per HSET
+
+    # Incremental mode only writes what changed since the last listing, and removes deleted files
+    incremental: Optional[bool] = True
+    redis_images_meta: Optional[str] = f"images_meta_{version}"
+    redis_images_changes: Optional[str] = f"images_changes_{version}"
+    changes_max_len: Optional[int] = 1000000  # Change feed entries kept (approximately)
+
+    @validator('path')
+    def no_leading_trailing_slash(cls, v):
+        return v.strip('/')
+
+
+def index_drive_process(drive_info: IndexDriveInfo, job: Optional[Job] = None):
+    """
+    Grabs all image metadata from Google drive
+
+    Pushes it to a Redis DB in chunked HSETs
+    """
+    if drive_info.incremental:
+        return incremental_index_drive_process(drive_info, job)
+
+    logger.debug(f"Fetching photos from {drive_info.rclone_drive}")
+    # Entries are indexed as rclone lists them, memory stays flat regardless of drive size
+    drive_files = iter_lsjson(f'{drive_info.rclone_drive}:/{drive_info.path}', '--files-only', '--hash', '--no-modtime', '--recursive')
+
+    start = time.monotonic()
+    images_processed = 0
+    chunk = {}
+
+    def flush():
+        # One round trip per chunk instead of one per image
+        if chunk:
+            r.hset(drive_info.redis_images_index, mapping=chunk)
+            chunk.clear()
+
+        elapsed = time.monotonic() - start
+        logger.debug(f"{images_processed} images indexed... ({images_processed / max(elapsed, 1e-6):.0f} files/sec)")
+        if job:
+            job.progress(images_processed)
+
+    for file in drive_files:
+        if (file.get("MimeType") == "image/jpeg"):
+            images_processed += 1
+
+            # Grab metadata
+            file_hash = file.get('Hashes').get('MD5')
+            file_path = file.get('Path')
+
+            # Queue data on our image for Redis
+            chunk[file_hash] = file_path
+            if len(chunk) >= drive_info.redis_chunk_size:
+                flush()
+
+    flush()
+    logger.debug(f'Done indexing! {images_processed} images indexed in {time.monotonic() - start:.1f}s.')
+
+
+def incremental_index_drive_process(drive_info: IndexDriveInfo, job: Optional[Job] = None):
+    """
+    Only write what changed since the last listing (see drive_index.sync_images_index)
+    """
+    logger.debug(f"Fetching photos from {drive_info.rclone_drive}")
+    drive_files = iter_lsjson(f'{drive_info.rclone_drive}:/{drive_info.path}', '--files-only', '--hash', '--recursive')
+
+    start = time.monotonic()
+
+    def on_progress(seen, stats):
+        elapsed = time.monotonic() - start
+        logger.debug(f"{seen} images listed... ({seen / max(elapsed, 1e-6):.0f} files/sec)")
+        if job:
+            job.progress(seen)
+            job.update(changes=stats)
+
+    sync_images_index(
+        r,
+        drive_files,
+        redis_images_index=drive_info.redis_images_index,
+        redis_images_meta=drive_info.redis_images_meta,
+        redis_images_changes=drive_info.redis_images_changes,
+        chunk_size=drive_info.redis_chunk_size,
+        changes_max_len=drive_info.changes_max_len,
+        on_progress=on_progress
+    )
+
+
+#################################
+#        Download Images        #
+#################################
+
+
+class DownloadDriveInfo(BaseModel):
+    rclone_drive: str
+    path: str
+    local_download_folder: str
+    redis_images_index: Optional[str] = f"images_index_{version}"
+    redis_downloaded_images: Optional[str] = f"downloaded_images_{version}"
+    redis_skipped_images: Optional[str] = f"skipped_images_{version}"
+    max_image_size: Optional[tuple] = (1024, 1024)
+
+    # Pipeline stage sizes
+    download_concurrency: Optional[int] = 2  # Concurrent rclone processes
+    transfer_batch_size: Optional[int] = 200  # Files per rclone process (--files-from manifest)
+    rclone_transfers: Optional[int] = 8  # rclone --transfers per process
+    rclone_checkers: Optional[int] = 16  # rclone --checkers per process
+    process_concurrency: Optional[int] = None  # Processes checking / resizing (None: the worker's CPU count)
+    redis_batch_size: Optional[int] = 100  # Results per pipelined Redis write
+
+    @validator('path')
+    def no_leading_trailing_slash(cls, v):
+        return v.strip('/')
+
+
+def download_training_files_process(drive_info: DownloadDriveInfo, job: Optional[Job] = None):
+    """
+    Downloads images from our index, store them in training folder
+
+    Transfers, MIME checks / resizing and Redis writes run as separate
+    stages, each with its own concurrency (see downloads.download_images)
+    """
+
+    try:
+        os.mkdir(drive_info.local_download_folder)
+    except FileExistsError:
+        pass
+
+    # Pull our whole image index
+    images = r.hgetall(drive_info.redis_images_index)
+    all_images = len(images)
+
+    # Remove downloaded / skipped images
+    [images.pop(downloaded_image, None) for downloaded_image in r.smembers(drive_info.redis_downloaded_images)]
+    [images.pop(skipped_image, None) for skipped_image in r.hkeys(drive_info.redis_skipped_images)]
+
+    # Decode our values
+    images = {image_hash.decode('utf-8'): image_path.decode('utf-8') for image_hash, image_path in images.items()}
+
+    new_images = len(images)
+
+    logger.info(f"Already processed {all_images - new_images}...")
+    if job:
+        job.update(skipped=all_images - new_images)
+        job.progress(0, total=new_images)
+
+    download_images(
+        r,
+        images,
+        rclone_drive=drive_info.rclone_drive,
+        path=drive_info.path,
+        local_download_folder=drive_info.local_download_folder,
+        max_image_size=drive_info.max_image_size,
+        redis_downloaded_images=drive_info.redis_downloaded_images,
+        redis_skipped_images=drive_info.redis_skipped_images,
+        download_concurrency=drive_info.download_concurrency,
+        transfer_batch_size=drive_info.transfer_batch_size,
+        rclone_transfers=drive_info.rclone_transfers,
+        rclone_checkers=drive_info.rclone_checkers,
+        process_concurrency=drive_info.process_concurrency,
+        redis_batch_size=drive_info.redis_batch_size,
+        on_progress=job.progress if job else None
+    )
+
+
+#################################
+#        Process Images         #
+#################################
+
+
+class ProcessImagesInfo(BaseModel):
+    local_download_folder: str
+    redis_downloaded_images: Optional[str] = f"downloaded_images_{version}"
+    redis_processed_images: Optional[str] = f"processed_images_{version}"
+    redis_face_table: Optional[str] = f"face_table_{version}"  # See face_table.FaceTable
+    max_image_size: Optional[int] = 1024  # Longest side sent to the extractor
+
+    # Pipeline stage sizes
+    batch_size: Optional[int] = 16  # Images per /extract call
+    process_concurrency: Optional[int] = None  # Processes decoding / resizing (None: the worker's CPU count)
+    max_concurrency: Optional[int] = 4  # /extract calls in flight
+
+    # Label new faces against the current gallery as they're found (no re-cluster needed for find_person)
+    assign_labels: Optional[bool] = True
+    min_similarity: Optional[float] = 0.4  # Cosine, same meaning as ClusterFacesInfo.min_similarity
+    redis_known_encodings: Optional[str] = "known_encodings"
+    redis_faces_to_images: Optional[str] = "faces_to_images"
+
+
+async def find_face_encodings_process(process_images_info: ProcessImagesInfo, job: Optional[Job] = None):
+    """
+    Process downloaded photos and find faces / encodings
+
+    Images already in redis_processed_images are skipped, so a crashed
+    or requeued job picks up where it stopped (see extraction.extract_faces).
+    New faces are labelled against the current gallery as they're written,
+    so their photos can be found right away
+    """
+    # Load all our images, minus processed ones
+    images = r.sdiff(process_images_info.redis_downloaded_images, process_images_info.redis_processed_images)
+    all_images = r.scard(process_images_info.redis_downloaded_images)
+    logger.debug(f'Skipping: {all_images - len(images)} (already processed)....')
+
+    # Decode images
+    images = sorted(image_hash.decode('utf-8') for image_hash in images)
+
+    if job:
+        job.update(skipped=all_images - len(images))
+        job.progress(0, total=len(images))
+
+    labeller = None
+    if process_images_info.assign_labels:
+        labeller = FaceLabeller(
+            FaceTable(r, process_images_info.redis_face_table),
+            redis_known_encodings=process_images_info.redis_known_encodings,
+            redis_faces_to_images=process_images_info.redis_faces_to_images,
+            min_similarity=process_images_info.min_similarity
+        )
+
+    stats = await extract_faces(
+        r,
+        images,
+        local_download_folder=process_images_info.local_download_folder,
+        redis_processed_images=process_images_info.redis_processed_images,
+        redis_face_table=process_images_info.redis_face_table,
+        max_image_size=process_images_info.max_image_size,
+        batch_size=process_images_info.batch_size,
+        process_concurrency=process_images_info.process_concurrency,
+        max_concurrency=process_images_info.max_concurrency,
+        labeller=labeller,
+        on_progress=job.progress if job else None
+    )
+
+    if job:
+        job.update(**stats)
+
+
+#################################
+#         Cluster Faces         #
+#################################
+
+
+class ClusterFacesInfo(BaseModel):
+    redis_face_table: Optional[str] = f"face_table_{version}"
+    redis_cluster_init_face_table: Optional[str] = f"cluster_init_face_table_{version}"
+    redis_label_profile_map: Optional[str] = f"cluster_init_label_profile_map_{version}"
+    # Cluster init faces extracted the old way (pickled set), imported into the table above when it's empty
+    redis_legacy_cluster_init_encodings: Optional[str] = f"cluster_init_all_face_encodings_{version}"
+
+    redis_faces_to_images: Optional[str] = "faces_to_images"
+    redis_centroids: Optional[str] = f"cluster_centroids_{version}"  # Same format as known_encodings
+    redis_known_encodings: Optional[str] = "known_encodings"
+    promote: Optional[bool] = False  # Copy the centroids to known_encodings, so predict uses them
+
+    method: Optional[str] = 'kmeans'  # 'nearest': assign to the seeds, 'kmeans': seeded mini-batch k-means first
+    iterations: Optional[int] = 1  # k-means passes over the face table
+    min_similarity: Optional[float] = 0.4  # Cosine; faces further than this from every person stay unknown
+    rebuild: Optional[bool] = True  # Clear the person -> image sets (and the legacy faces_to_images hash) first
+
+    @validator('method')
+    def known_method(cls, v):
+        if v not in ('nearest', 'kmeans'):
+            raise ValueError("method must be 'nearest' or 'kmeans'")
+        return v
+
+
+def cluster_faces_process(cluster_info: ClusterFacesInfo, job: Optional[Job] = None):
+    """
+    Label every extracted face with a person, seeded from the cluster init portraits
+
+    Writes labels, person -> image sets and the centroids (promoted to
+    known_encodings only if asked), then tells the API to reload its gallery
+    """
+    table = FaceTable(r, cluster_info.redis_face_table)
+    init_table = FaceTable(r, cluster_info.redis_cluster_init_face_table)
+    if not len(init_table):
+        import_legacy_face_encodings(r, cluster_info.redis_legacy_cluster_init_encodings, init_table)
+
+    label_profile_map = {img_hash.decode('utf-8'): profile.decode('utf-8') for img_hash, profile in r.hgetall(cluster_info.redis_label_profile_map).items()}
+
+    if job:
+        job.progress(0, total=len(table))
+
+    stats = cluster_faces(
+        r,
+        table,
+        init_table,
+        label_profile_map,
+        redis_faces_to_images=cluster_info.redis_faces_to_images,
+        redis_centroids=cluster_info.redis_centroids,
+        method=cluster_info.method,
+        iterations=cluster_info.iterations,
+        min_similarity=cluster_info.min_similarity,
+        rebuild=cluster_info.rebuild,
+        on_progress=job.progress if job else None
+    )
+
+    if cluster_info.promote:
+        set_profiles(r, cluster_info.redis_known_encodings, r.get(cluster_info.redis_centroids))
+        logger.info(f"Promoted {cluster_info.redis_centroids} to {cluster_info.redis_known_encodings}")
+
+    bump_gallery_version(r)
+    if job:
+        job.update(promoted=int(cluster_info.promote), **stats)
+
+
+#################################
+#         Find Person           #
+#################################
+
+
+class FindPerson(BaseModel):
+    search_string: str
+    rclone_drive: str
+    path: str
+    output_dir: str
+
+    # redis_images_index: Optional[str] = f"images_index_{version}"
+    # redis_faces_to_images: Optional[str] = f"faces_to_images_{version}"
+    redis_images_index: Optional[str] = f"images_index_{version}"
+    redis_faces_to_images: Optional[str] = f"faces_to_images"
+
+    max_candidates: Optional[int] = 5  # Name matches returned for disambiguation
+
+    rclone_batch_size: Optional[int] = 50  # Copies per rclone process
+    rclone_transfers: Optional[int] = 4  # Concurrent copies within a process
+    max_concurrency: Optional[int] = 2  # rclone processes at once (total copies in flight = this x rclone_transfers)
+    max_retries: Optional[int] = 5  # Per copy, only for rate limit errors
+    retry_backoff: Optional[float] = 2.  # Seconds, doubled every retry
+
+    @validator('path')
+    def no_leading_trailing_slash(cls, v):
+        return v.strip('/')
+
+
+async def find_person_process(find_person_info: FindPerson, closest_match: str, job: Optional[Job] = None):
+    """
+    Find all images of a specific person
+
+    Copies run through a bounded pool of rclone batches, rate limited
+    copies are retried with backoff, and done / total / failed are kept
+    up to date on the job
+    """
+    source_fs = f'{find_person_info.rclone_drive}:/{find_person_info.path}'
+    output_fs = f'{find_person_info.rclone_drive}:/{find_person_info.output_dir}/{closest_match}'
+
+    subprocess.run(['rclone', 'mkdir', output_fs])
+
+    # Read the person's photos straight from Redis so newly indexed ones are included
+    photos = list(iter_person_images(r, find_person_info.redis_faces_to_images, closest_match))
+    photo_paths = r.hmget(find_person_info.redis_images_index, photos) if photos else []
+
+    # Skip photos already in the output folder (re-runs, resumed jobs) and duplicate names
+    already_copied = await list_file_names(output_fs)
+    copies = {}
+    skipped = 0  # This person's photos already in the output folder
+    for photo, photo_path in zip(photos, photo_paths):
+        if photo_path is None:
+            logger.warning(f"{photo} is no longer in the image index")
+            continue
+
+        photo_path = photo_path.decode('utf-8')
+        photo_name = photo_path.rsplit('/', maxsplit=1)[-1]
+        if photo_name in already_copied:
+            skipped += 1
+        else:
+            copies.setdefault(photo_name, photo_path)
+
+    logger.debug(f"Copying {len(copies)} photos of {closest_match} ({skipped} already there)")
+    progress = {'done': 0, 'failed': 0}
+    if job:
+        job.update(profile_name=closest_match, skipped=skipped, done=0, failed=0)
+        job.progress(0, total=len(copies))
+
+    # Batches of (photo_name, photo_path, attempt)
+    pending = list(copies.items())
+    queue = asyncio.Queue()
+    for start in range(0, len(pending), find_person_info.rclone_batch_size):
+        queue.put_nowait([(name, path, 0) for name, path in pending[start:start + find_person_info.rclone_batch_size]])
+
+    async def worker():
+        while not queue.empty():
+            batch = queue.get_nowait()
+            errors = await copyfile_batch([(source_fs, path, output_fs, name) for name, path, _ in batch], concurrency=find_person_info.rclone_transfers)
+
+            retries = []
+            for (name, path, attempt), error in zip(batch, errors):
+                if error is None:
+                    progress['done'] += 1
+                elif is_rate_limited(error) and attempt < find_person_info.max_retries:
+                    retries.append((name, path, attempt + 1))
+                else:
+                    progress['failed'] += 1
+                    logger.error(f"Unable to copy {path}: {error}")
+
+            if job:
+                job.update(**progress)
+                job.progress(progress['done'] + progress['failed'])
+
+            if retries:
+                delay = find_person_info.retry_backoff * 2 ** (retries[0][2] - 1)
+                logger.warning(f"Rate limited, retrying {len(retries)} copies in {delay:.0f}s....")
+                await asyncio.sleep(delay)
+                queue.put_nowait(retries)
+
+    await asyncio.gather(*[worker() for _ in range(find_person_info.max_concurrency)])
+
+    logger.debug(f"Done finding {closest_match}! {progress['done']} copied, {progress['failed']} failed")
+
+
+#################################
+#           Registry            #
+#################################
+
+
+# Job kind -> runner(payload, job), used by miles_api.worker
+TASKS = {
+    'index_drive': lambda payload, job: index_drive_process(IndexDriveInfo(**payload), job),
+    'download_training_images': lambda payload, job: download_training_files_process(DownloadDriveInfo(**payload), job),
+    'find_faces': lambda payload, job: find_face_encodings_process(ProcessImagesInfo(**payload), job),
+    'cluster_faces': lambda payload, job: cluster_faces_process(ClusterFacesInfo(**payload), job),
+    'find_person': lambda payload, job: find_person_process(FindPerson(**payload['find_person_info']), payload['closest_match'], job),
+}
@@ -0,0 +1,72 @@
+import socket
+import asyncio
+import inspect
+import threading
+import traceback
+
+from loguru import logger
+
+from miles_api.redis import r
+from miles_api.jobs import JobQueue
+from miles_api.tasks import TASKS
+from miles_api.resources.default_configs import (
+    WORKER_NAME,
+    WORKER_HEARTBEAT_TTL
+)
+
+
+def heartbeat(queue: JobQueue, worker_name: str, stop: threading.Event):
+    """
+    Keep our heartbeat key alive, so nobody steals the job we're running
+    """
+    while not stop.is_set():
+        queue.heartbeat(worker_name)
+        stop.wait(WORKER_HEARTBEAT_TTL / 3)
+
+
+def run_job(job):
+    result = TASKS[job.kind](job.payload, job)
+    if inspect.isawaitable(result):
+        asyncio.run(result)
+
+
+def main():
+    """
+    Pull jobs off the Redis queue and run them one at a time, until killed
+
+    Scale out by running more workers. A worker that dies mid-job has its
+    job requeued (by itself on restart, or by any other worker once its
+    heartbeat expires); tasks skip work already recorded in Redis, so
+    the job resumes where it stopped.
+    """
+    worker_name = WORKER_NAME or socket.gethostname()
+    queue = JobQueue(r)
+
+    stop = threading.Event()
+    threading.Thread(target=heartbeat, args=(queue, worker_name, stop), daemon=True).start()
+
+    queue.recover(worker_name)
+    logger.info(f"Worker {worker_name} waiting for jobs on {queue.queue_key}....")
+
+    try:
+        while True:
+            job = queue.reserve(worker_name)
+            if job is None:
+                queue.recover(worker_name)  # Idle, look for jobs orphaned by dead workers
+                continue
+
+            logger.info(f"Running {job.kind} job {job.id}")
+            try:
+                run_job(job)
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {traceback.format_exc()}")
+                queue.finish(worker_name, job, error=f'{type(e).__name__}: {e}')
+            else:
+                queue.finish(worker_name, job)
+                logger.info(f"Finished {job.kind} job {job.id}")
+    finally:
+        stop.set()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,27 @@
 import re
+import time
 import subprocess
 import json
 import requests
 
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+
 from loguru import logger
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from os import environ
 
-from miles_slack.slack_files import download_slack_file, upload_slack_file
+from miles_slack.slack_files import (
+    download_slack_file,
+    upload_slack_file,
+    create_session,
+    pick_slack_image,
+    multipart_stream,
+    spool_response,
+    SLACK_CHUNK_SIZE,
+    SLACK_MAX_CONCURRENCY
+)
 
 BASE_API_URL = environ.get("BASE_API_URL").rstrip('/')
 RCLONE_DRIVE = environ.get("RCLONE_DRIVE")
@@ -22,10 +35,77 @@ SLACK_SOCKET_TOKEN = environ.get("SLACK_SOCKET_TOKEN")
 
 app = App(token=SLACK_BOT_TOKEN)
 
+# Attached files are labelled in parallel (bounded), over one keep-alive pool to the API
+file_pool = ThreadPoolExecutor(max_workers=SLACK_MAX_CONCURRENCY, thread_name_prefix='slack-file')
+api_session = create_session()
+
 command_filter = re.compile(r'<@.*>(.*)')  # turns '<@U01KMRM2YTG> hello world' to 'hello world'
 arg_filter = re.compile(r'\s(.*)')  # turns 'find Thomas Web' into 'Thomas Web'
 
 
+def report_find_person(say, job_id, poll_interval=5, timeout=6 * 3600):
+    """
+    Poll a find_person job until it finishes, then post the outcome
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(poll_interval)
+        try:
+            job = api_session.get(f'{BASE_API_URL}/jobs/{job_id}').json()
+        except (requests.ConnectionError, ValueError) as e:
+            logger.error(f"Unable to check job {job_id}: {e}")
+            continue
+
+        if job.get('status') == 'done':
+            say(f"Done! Uploaded {job.get('done')}/{job.get('total')} photos of {job.get('profile_name')} ({job.get('failed')} failed, {job.get('skipped')} already there)")
+            return
+        if job.get('status') == 'failed':
+            say(f"Unable to upload photos of {job.get('profile_name')}: {job.get('error')}")
+            return
+
+
+@logger.catch
+def label_slack_file(file, channel, say, client):
+    """
+    Download one attached file, label it through the API and post the result
+    """
+    # Stream the Slack File (smallest copy the detector can still use) straight into the API request
+    download = download_slack_file(pick_slack_image(file))
+    if download is None:
+        say(f"Unable to download {file.get('name')} from Slack")
+        return
+
+    try:
+        content_type, body = multipart_stream('image', file.get('name') or 'image', download.iter_content(SLACK_CHUNK_SIZE), file.get('mimetype') or 'application/octet-stream')
+
+        with api_session.post(url=f'{BASE_API_URL}/predict_label_image/', data=body, headers={'Content-Type': content_type}, stream=True) as req:
+            req.raise_for_status()
+            labelled, length = spool_response(req)
+
+        with labelled:
+            upload_slack_file(
+                file=labelled,
+                length=length,
+                channel=channel,
+                client=client,
+                message="Here you go!"
+            )
+
+        # accuracy_scores = [f'Top guesses: {guess} {score}%\n' for guess, score in json.loads(req.headers.get('accuracy_scores'))]
+        accuracy_scores = [f'*{profile[0][0]}* ({profile[0][1]}% match)... or {profile[1][0]} ({profile[1][1]}% match)... or {profile[2][0]} ({profile[2][1]}% match)\n' for profile in json.loads(req.headers.get('x-accuracy_scores')).values()]
+
+        say("Match stats:\n{0}".format(accuracy_scores.__str__().strip('[]').replace('\\n', '\n').replace("'", "").replace(', ', '')))
+
+    except requests.ConnectionError as e:
+        logger.error(f"Unable to reach backend.... {e}")
+        say("Internal error... unable to reach backend: miles_api")
+    except requests.HTTPError as e:
+        logger.error(f"Unable to label image.... {e}")
+        say(f"Unable to label {file.get('name')}: {e}")
+    finally:
+        download.close()
+
+
 @app.event("app_mention")
 def event_test(say, event, client):
     say("Got it! Gimmie a hot sec....")
@@ -35,33 +115,9 @@ def event_test(say, event, client):
     files = event.get("files")
 
     if files:
+        # Hand every file to the pool and return; each posts its own result when done
         for file in files:
-            # Download Slack File
-            image_stream = download_slack_file(file.get("thumb_1024") or file.get("url_private_download"))  # if smaller than 1024x1024
-
-            logger.debug(f"File downloaded!")
-
-            try:
-                req = requests.post(
-                    url=f'{BASE_API_URL}/predict_label_image/',
-                    files={'image': image_stream},
-                )
-
-                upload_slack_file(
-                    file=req.content,
-                    channel=channel,
-                    client=client,
-                    message="Here you go!"
-                )
-
-                # accuracy_scores = [f'Top guesses: {guess} {score}%\n' for guess, score in json.loads(req.headers.get('accuracy_scores'))]
-                accuracy_scores = [f'*{profile[0][0]}* ({profile[0][1]}% match)... or {profile[1][0]} ({profile[1][1]}% match)... or {profile[2][0]} ({profile[2][1]}% match)\n' for profile in json.loads(req.headers.get('x-accuracy_scores')).values()]
-
-                say("Match stats:\n{0}".format(accuracy_scores.__str__().strip('[]').replace('\\n', '\n').replace("'", "").replace(', ', '')))
-
-            except requests.ConnectionError as e:
-                logger.error(f"Unable to reach backend.... {e}")
-                say("Internal error... unable to reach backend: miles_api")
+            file_pool.submit(label_slack_file, file, channel, say, client)
 
     elif command.split(" ")[0] == "find":
         name = command.split(" ", maxsplit=1)[-1]  # Take everything past the first word
@@ -74,14 +130,19 @@ def event_test(say, event, client):
                 "output_dir": DRIVE_OUTPUT_DIR,
             }
 
-            req = requests.post(
+            req = api_session.post(
                 url=f'{BASE_API_URL}/find_person/',
                 data=json.dumps(payload)
             )
 
-            say(f"Uploading photos of: {json.loads(req.text).get('profile_name')} to {RCLONE_DRIVE}:{DRIVE_OUTPUT_DIR}")
+            job = json.loads(req.text)
+            say(f"Uploading photos of: {job.get('profile_name')} to {RCLONE_DRIVE}:{DRIVE_OUTPUT_DIR}")
             say(f"{DRIVE_OUTPUT_LINK}")
 
+            # Report back once the copies are done, without holding up this handler
+            if job.get('job_id'):
+                Thread(target=report_find_person, args=(say, job.get('job_id')), daemon=True).start()
+
         except requests.ConnectionError as e:
             logger.error(f"Unable to reach backend.... {e}")
             say("Internal error... unable to reach backend: miles_api")
@@ -1,47 +1,129 @@
+import uuid
 import requests
 
+from requests.adapters import HTTPAdapter
+
 from os import environ
-from io import BytesIO
+from tempfile import SpooledTemporaryFile
 from slack_sdk.errors import SlackApiError
 from loguru import logger
 
 SLACK_BOT_TOKEN = environ.get("SLACK_BOT_TOKEN")
+SLACK_MAX_CONCURRENCY = int(environ.get("SLACK_MAX_CONCURRENCY", 4))
+SLACK_CHUNK_SIZE = int(environ.get("SLACK_CHUNK_SIZE", 64 * 1024))  # Bytes buffered per read / write
+SLACK_SPOOL_SIZE = int(environ.get("SLACK_SPOOL_SIZE", 4 * 1024 * 1024))  # Larger API responses spill to disk
+DETECTOR_INPUT_SIZE = int(environ.get("DETECTOR_INPUT_SIZE", 1024))  # Longest side the API actually looks at
+
+# Slack thumbnails fit inside NxN boxes, smallest first
+SLACK_THUMB_SIZES = (64, 80, 160, 360, 480, 720, 800, 960, 1024)
+
+
+def create_session(max_connections=SLACK_MAX_CONCURRENCY, **headers):
+    """
+    Session with a keep-alive pool big enough for every file handled at once
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=max_connections)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(headers)
+    return session
+
+
+# Shared by every download, so files reuse Slack connections
+slack_session = create_session(Authorization=f'Bearer {SLACK_BOT_TOKEN}')
+
+
+def pick_slack_image(file, min_size=DETECTOR_INPUT_SIZE):
+    """
+    Smallest thumbnail still at least min_size on its longest side
+
+    Falls back to the original, which is also what Slack gives us when
+    the image is smaller than the thumbnail sizes
+    """
+    for size in SLACK_THUMB_SIZES:
+        url = file.get(f"thumb_{size}")
+        longest = max(file.get(f"thumb_{size}_w") or 0, file.get(f"thumb_{size}_h") or 0)
+        if url and longest >= min_size:
+            return url
+    return file.get("url_private_download")
 
 
 def download_slack_file(url):
     """
-    Grab file from Slack using bot token
+    Open a streamed download of a Slack file using bot token
 
     There's not a BOLT SDK implementation to download files
 
-    return: Image file-object
+    return: response to read with iter_content (close it when done), or None
     """
     try:
         logger.info(f"Downloading file: {url}")
-        # Image binary data needs to be a binary stream (like a file-object)
-        return BytesIO(requests.get(url, headers={'Authorization': f'Bearer {SLACK_BOT_TOKEN}'}).content)
+        response = slack_session.get(url, stream=True)
+        response.raise_for_status()
+        return response
     except Exception as e:
-        print(f"Unable to grab file: {e}")
+        logger.error(f"Unable to grab file: {e}")
         return None
 
 
-def upload_slack_file(file, channel, client, message):
+def multipart_stream(field, filename, chunks, content_type='application/octet-stream'):
+    """
+    multipart/form-data body for a single file, generated as the file's chunks arrive
+
+    requests sends a generator body with chunked encoding, so the file is
+    never held in memory as a whole
+
+    return: Content-Type header, body generator
+    """
+    boundary = uuid.uuid4().hex
+
+    def body():
+        yield (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        yield from chunks
+        yield f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+    return f'multipart/form-data; boundary={boundary}', body()
+
+
+def spool_response(response, max_size=SLACK_SPOOL_SIZE):
     """
-    Uploads files to Slack using BOLT SDK
+    Copy a streamed response into a file that only stays in memory while it's small
 
-    https://api.slack.com/methods/files.upload/code
+    return: file rewound to the start, its length
+    """
+    spool = SpooledTemporaryFile(max_size=max_size)
+    for chunk in response.iter_content(SLACK_CHUNK_SIZE):
+        spool.write(chunk)
+    length = spool.tell()
+    spool.seek(0)
+    return spool, length
+
+
+def upload_slack_file(file, length, channel, client, message, filename="labelled.jpg"):
+    """
+    Uploads files to Slack, streaming them from a file-object
+
+    https://api.slack.com/messages/working-with-files#upload
     """
     try:
-        # Call the files.upload method using the WebClient
         # Uploading files requires the `files:write` scope
-        result = client.files_upload(
-            channels=channel,
-            initial_comment=message,
-            file=file,
-            filetype="jpeg"
+        upload = client.files_getUploadURLExternal(filename=filename, length=length)
+
+        # requests streams file-objects in blocks instead of reading them whole
+        slack_session.post(upload['upload_url'], data=file, headers={'Content-Type': 'application/octet-stream'}).raise_for_status()
+
+        result = client.files_completeUploadExternal(
+            files=[{'id': upload['file_id'], 'title': filename}],
+            channel_id=channel,
+            initial_comment=message
         )
         # Log the result
         logger.info(result)
 
-    except SlackApiError as e:
+    except (SlackApiError, requests.RequestException) as e:
         logger.error("Error uploading file: {}".format(e))
@@ -106,7 +106,13 @@ def scan_image_index():
 
             # Set image references in Redis
             [r.hset(images_to_faces, img_hash, json.dumps(img_faces)) for img_hash, img_faces in batch_faces.items()]
-            [r.hset(faces_to_images, img_face, json.dumps(json.loads(r.hget(faces_to_images, img_face) or '[]') + [img_hash])) for img_hash, img_faces in batch_faces.items() for img_face in img_faces]
+            # One set per person ({faces_to_images}:person:{name}), added to in a single round trip
+            pipe = r.pipeline(transaction=False)
+            for img_hash, img_faces in batch_faces.items():
+                for img_face in img_faces:
+                    pipe.sadd(f"{faces_to_images}:people", img_face)
+                    pipe.sadd(f"{faces_to_images}:person:{img_face}", img_hash)
+            pipe.execute()
 
             # Remove / Create new temp dir
             shutil.rmtree("temp/")
@@ -0,0 +1,89 @@
+import os
+import shutil
+import pytest
+
+pytest.importorskip('magic')
+pytest.importorskip('PIL')
+
+from miles_api import downloads
+from miles_api.downloads import transfer
+from miles_api.rclone import copy_files_from
+
+needs_rclone = pytest.mark.skipif(shutil.which('rclone') is None, reason='rclone not installed')
+
+
+@pytest.fixture
+def drive(tmp_path):
+    """
+    A local directory standing in for the Drive remote
+    """
+    source = tmp_path / 'drive'
+    (source / 'sub').mkdir(parents=True)
+    (source / 'a.jpg').write_bytes(b'a')
+    (source / 'sub' / 'b.jpg').write_bytes(b'b')
+    return source
+
+
+@pytest.fixture
+def local(tmp_path):
+    folder = tmp_path / 'local'
+    folder.mkdir()
+    return folder
+
+
+def fake_copy_files_from(source, destination, paths, **kwargs):
+    """
+    copy_files_from without rclone: same results, local copies only
+    """
+    results = {}
+    for path in paths:
+        try:
+            os.makedirs(os.path.dirname(os.path.join(destination, path)), exist_ok=True)
+            shutil.copyfile(os.path.join(source, path), os.path.join(destination, path))
+            results[path] = None
+        except OSError as e:
+            results[path] = str(e)
+    return results
+
+
+def check_shared_path_batch(drive, local):
+    batch = {'h1': 'a.jpg', 'h2': 'a.jpg', 'h3': 'sub/b.jpg', 'h4': 'missing.jpg'}
+
+    results = transfer(str(drive), str(local), batch, transfers=2, checkers=2)
+
+    assert [image_hash for image_hash, error in results.items() if error is None] == ['h1', 'h2', 'h3']
+    assert results['h4']
+    assert (local / 'h1').read_bytes() == (local / 'h2').read_bytes() == b'a'
+    assert (local / 'h3').read_bytes() == b'b'
+    assert sorted(os.listdir(local)) == ['h1', 'h2', 'h3']  # Staging folder cleaned up
+
+
+def test_transfer_shared_path_and_missing_file(drive, local, monkeypatch):
+    monkeypatch.setattr(downloads, 'copy_files_from', fake_copy_files_from)
+    check_shared_path_batch(drive, local)
+
+
+def test_transfer_move_failure_only_fails_its_hash(drive, local, monkeypatch):
+    monkeypatch.setattr(downloads, 'copy_files_from', fake_copy_files_from)
+    (local / 'h2' / 'in-the-way').mkdir(parents=True)  # os.replace can't overwrite a non-empty directory
+
+    results = transfer(str(drive), str(local), {'h1': 'a.jpg', 'h2': 'sub/b.jpg'}, transfers=2, checkers=2)
+
+    assert results['h1'] is None and results['h2']
+    assert (local / 'h1').read_bytes() == b'a'
+
+
+@needs_rclone
+def test_copy_files_from_local_remote(drive, tmp_path):
+    destination = tmp_path / 'out'
+
+    results = copy_files_from(str(drive), str(destination), ['a.jpg', 'sub/b.jpg', 'missing.jpg'])
+
+    assert results['a.jpg'] is None and results['sub/b.jpg'] is None
+    assert results['missing.jpg']
+    assert (destination / 'sub' / 'b.jpg').read_bytes() == b'b'
+
+
+@needs_rclone
+def test_transfer_with_rclone(drive, local):
+    check_shared_path_batch(drive, local)
@@ -0,0 +1,109 @@
+import json
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from miles_api.drive_index import sync_images_index
+
+INDEX, META, CHANGES = 'images_index', 'images_meta', 'images_changes'
+
+
+def listing(*files):
+    return [{'Path': path, 'MimeType': 'image/jpeg', 'Size': 1, 'ModTime': mtime, 'Hashes': {'MD5': md5}} for path, md5, mtime in files]
+
+
+def sync(r, files, **kwargs):
+    return sync_images_index(r, files, INDEX, META, CHANGES, **kwargs)
+
+
+def index(r):
+    return {md5.decode(): path.decode() for md5, path in r.hgetall(INDEX).items()}
+
+
+def events(r):
+    return [{k.decode(): v.decode() for k, v in fields.items()} for _, fields in r.xrange(CHANGES)]
+
+
+@pytest.fixture
+def r():
+    return fakeredis.FakeRedis()
+
+
+def test_add_move_modify_delete(r):
+    sync(r, listing(('a.jpg', 'A', 't0'), ('b.jpg', 'B', 't0'), ('c.jpg', 'C', 't0')))
+    assert index(r) == {'A': 'a.jpg', 'B': 'b.jpg', 'C': 'c.jpg'}
+    r.delete(CHANGES)
+
+    # a.jpg moved, b.jpg re-edited, c.jpg deleted, d.jpg added
+    stats = sync(r, listing(('new/a.jpg', 'A', 't0'), ('b.jpg', 'B2', 't1'), ('d.jpg', 'D', 't0')))
+
+    assert index(r) == {'A': 'new/a.jpg', 'B2': 'b.jpg', 'D': 'd.jpg'}
+    assert set(json.loads(meta)['md5'] for meta in r.hvals(META)) == {'A', 'B2', 'D'}
+    assert {k: stats[k] for k in ('add', 'move', 'modify', 'delete')} == {'add': 1, 'move': 1, 'modify': 1, 'delete': 1}
+
+    by_op = {event['op']: event for event in events(r)}
+    assert by_op['move']['old_path'] == 'a.jpg' and by_op['move']['path'] == 'new/a.jpg'
+    assert by_op['modify']['old_md5'] == 'B' and by_op['modify']['md5'] == 'B2'
+    assert by_op['delete']['md5'] == 'C'
+
+
+def test_modify_keeps_old_md5_still_present_elsewhere(r):
+    sync(r, listing(('a.jpg', 'A', 't0'), ('copy.jpg', 'A', 't0')))
+    sync(r, listing(('a.jpg', 'A2', 't1'), ('copy.jpg', 'A', 't0')))
+    assert index(r) == {'A': 'copy.jpg', 'A2': 'a.jpg'}
+
+
+def test_unchanged_listing_writes_nothing(r):
+    files = listing(('a.jpg', 'A', 't0'))
+    sync(r, files)
+    r.delete(CHANGES)
+    stats = sync(r, files)
+    assert stats['add'] == stats['modify'] == stats['delete'] == 0
+    assert events(r) == []
+
+
+def test_first_run_drops_stale_index_entries(r):
+    r.hset(INDEX, mapping={'A': 'a.jpg', 'OLD': 'gone.jpg'})  # Left by a full (non-incremental) run
+    sync(r, listing(('a.jpg', 'A', 't0')))
+    assert index(r) == {'A': 'a.jpg'}
+    assert {'op': 'delete', 'md5': 'OLD', 'path': 'gone.jpg', 'old_path': '', 'old_md5': ''} in events(r)
+
+
+def test_crashed_run_is_resumed_without_losing_events(r):
+    sync(r, listing(('a.jpg', 'A', 't0')))
+    r.delete(CHANGES)
+    files = listing(('a.jpg', 'A', 't0'), ('b.jpg', 'B', 't0'), ('c.jpg', 'C', 't0'), ('d.jpg', 'D', 't0'))
+
+    # Die after the first committed chunk
+    def crash(seen, stats):
+        if stats['add']:
+            raise RuntimeError('worker killed')
+
+    with pytest.raises(RuntimeError):
+        sync(r, files, chunk_size=3, on_progress=crash)
+
+    sync(r, files, chunk_size=3)
+
+    assert index(r) == {'A': 'a.jpg', 'B': 'b.jpg', 'C': 'c.jpg', 'D': 'd.jpg'}
+    added = [event['path'] for event in events(r) if event['op'] == 'add']
+    assert sorted(added) == ['b.jpg', 'c.jpg', 'd.jpg']
+
+
+def test_changes_are_written_while_listing(r):
+    files = listing(('a.jpg', 'A', 't0'), ('b.jpg', 'B', 't0'), ('c.jpg', 'C', 't0'))
+
+    def stream():
+        yield from files[:2]
+        assert index(r) == {'A': 'a.jpg', 'B': 'b.jpg'}  # First chunk committed before rclone is done
+        yield from files[2:]
+
+    sync(r, stream(), chunk_size=2)
+    assert index(r) == {'A': 'a.jpg', 'B': 'b.jpg', 'C': 'c.jpg'}
+
+
+def test_deleting_one_copy_keeps_the_other_indexed(r):
+    sync(r, listing(('a.jpg', 'A', 't0'), ('copy.jpg', 'A', 't0')))
+    r.hset(INDEX, 'A', 'a.jpg')
+    sync(r, listing(('copy.jpg', 'A', 't0')))
+    assert index(r) == {'A': 'copy.jpg'}
+    assert not r.exists(f'{META}:dropped')
@@ -0,0 +1,126 @@
+import os
+import asyncio
+import pytest
+
+from io import BytesIO
+
+fakeredis = pytest.importorskip('fakeredis')
+Image = pytest.importorskip('PIL.Image')
+
+os.environ.setdefault('REDIS_HOST', 'localhost')  # miles_api.redis builds its (lazy) client at import
+
+from miles_api import tasks, extraction
+from miles_api.extractor import ExtractorError
+from miles_api.extraction import extract_faces, write_faces
+from miles_api.face_table import FaceTable
+
+PROCESSED, TABLE = 'processed_images', 'face_table'
+
+
+class StubExtractor:
+    """
+    Stands in for ExtractorClient: one face per image, and fails any batch holding a rejected payload
+    """
+
+    def __init__(self, rejected=()):
+        self.rejected = set(rejected)
+        self.seen = []
+
+    async def extract(self, images):
+        self.seen.extend(images)
+        if self.rejected & set(images):
+            raise ExtractorError('rejected')
+        return [[{'bbox': [0, 0, 1, 1], 'vec': [float(len(image)), 1., 0.]}] for image in images]
+
+    async def aclose(self):
+        pass
+
+
+def jpeg(color, size=(8, 8)):
+    out = BytesIO()
+    Image.new('RGB', size, color).save(out, format='JPEG')
+    return out.getvalue()
+
+
+@pytest.fixture
+def r():
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture
+def images(tmp_path):
+    """
+    Four downloaded images; 'bad' is the one the stub rejects
+    """
+    payloads = {f'{name:0<32}': jpeg(color, size) for name, color, size in [
+        ('a', 'red', (8, 8)), ('b', 'green', (9, 9)), ('bad', 'blue', (10, 10)), ('d', 'white', (11, 11))
+    ]}
+    for image_hash, payload in payloads.items():
+        (tmp_path / f'{image_hash}.jpg').write_bytes(payload)
+    return tmp_path, payloads
+
+
+def processed(r):
+    return {image_hash.decode() for image_hash in r.smembers(PROCESSED)}
+
+
+def table_hashes(r):
+    return sorted(img_hash for _, _, _, img_hashes in FaceTable(r, TABLE).iter_segments() for img_hash in img_hashes.astype(str))
+
+
+def run(r, folder, image_hashes, client):
+    return asyncio.run(extract_faces(
+        r, sorted(image_hashes), str(folder), PROCESSED, TABLE, batch_size=2, process_concurrency=1, max_concurrency=1, client=client
+    ))
+
+
+def test_faces_and_checkpoint_are_one_transaction(r, monkeypatch):
+    pipes = []
+    pipeline = r.pipeline
+
+    def spy(*args, **kwargs):
+        pipes.append(pipeline(*args, **kwargs))
+        return pipes[-1]
+
+    monkeypatch.setattr(r, 'pipeline', spy)
+    write_faces(FaceTable(r, TABLE), [('a' * 32, [{'bbox': [0, 0, 1, 1], 'vec': [1., 0.]}]), ('b' * 32, [])], PROCESSED)
+
+    assert len(pipes) == 1 and pipes[0].transaction
+    assert processed(r) == {'a' * 32, 'b' * 32}
+    assert table_hashes(r) == ['a' * 32]
+
+
+def test_failed_batch_is_not_checkpointed(r, images):
+    folder, payloads = images
+    client = StubExtractor(rejected=[payloads[f'{"bad":0<32}']])
+
+    stats = run(r, folder, payloads, client)
+
+    ok = {image_hash for image_hash in payloads if not image_hash.startswith(('bad', 'd'))}  # 'd' shares the bad batch
+    assert processed(r) == ok
+    assert table_hashes(r) == sorted(ok)
+    assert stats['failed'] == 2 and stats['done'] == 2
+
+
+def test_rerun_skips_processed_images(r, images, monkeypatch):
+    folder, payloads = images
+    bad = payloads[f'{"bad":0<32}']
+    r.sadd('downloaded_images', *payloads)
+
+    monkeypatch.setattr(tasks, 'r', r)
+    info = tasks.ProcessImagesInfo(
+        local_download_folder=str(folder), redis_downloaded_images='downloaded_images', redis_processed_images=PROCESSED,
+        redis_face_table=TABLE, batch_size=2, process_concurrency=1, max_concurrency=1, assign_labels=False
+    )
+
+    first = StubExtractor(rejected=[bad])
+    monkeypatch.setattr(extraction, 'ExtractorClient', lambda **kwargs: first)
+    asyncio.run(tasks.find_face_encodings_process(info))
+
+    second = StubExtractor()
+    monkeypatch.setattr(extraction, 'ExtractorClient', lambda **kwargs: second)
+    asyncio.run(tasks.find_face_encodings_process(info))
+
+    assert sorted(second.seen) == sorted([bad, payloads[f'{"d":0<32}']])  # Only the batch that failed is sent again
+    assert processed(r) == set(payloads)
+    assert table_hashes(r) == sorted(payloads)